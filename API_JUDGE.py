@@ -1,11 +1,28 @@
+import os
+import re
 import json
 import csv
-import time
 import yaml
-import threading
+import asyncio
+import hashlib
+from collections import Counter, defaultdict
 from pathlib import Path
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from RUNS1 import normalize_answer
+from Collector.cache import ResponseCache
+from Collector.limiter import AIMDRegistry, print_limits
+from Collector.providers import build_client, cached_prompt_tokens
+from Collector.retry import Retrier, call_with_retry, print_retry_stats
+from Collector.ledger import CostLedger, print_ledger
+
+JUDGE_MODEL = "deepseek/deepseek-chat"
+JUDGE_CONCURRENCY = 10  # AIMD 初始并发，之后按 429/延迟自适应
+HEDGE = False           # 超过近期 p95 仍未返回时补发一份对冲请求
+BUDGET_USD = None       # 本次裁判的美元预算，用尽后其余行保留原有 T_F 不再送审
+USE_VERDICT_CACHE = True                         # 持久化判定缓存：同一 (题目, 答案, 标准答案) 只判一次
+JUDGE_BATCH_SIZE = 20                            # 每个请求最多打包的判定条数，1 为逐条判定
+JUDGE_CONTEXT_TOKENS = 64_000                    # 裁判模型上下文长度，打包时按估算 token 数留足余量
+JUDGE_VERDICT_TOKENS = 12                        # 判定数组中每一项的输出 token 估计
+VERDICT_CACHE_PATH = Path("Cache/verdicts.sqlite")
 
 
 # --- 1. 深度标准化函数 ---
@@ -20,63 +37,229 @@ def super_normalize(text):
     return " ".join(text.split()).strip()
 
 
+def load_ground_truth(si_json_path):
+    """标准答案库：超强标准化后的题面 -> 标准答案"""
+    ground_truth = {}
+    with open(si_json_path, 'r', encoding='utf-8') as j:
+        data = json.load(j)
+        for item in data:
+            # 兼容字段名：task 或 question
+            q_raw = item.get("task") or item.get("question")
+            ans = item.get("correct")
+            if q_raw:
+                # 键名进行超强标准化
+                ground_truth[super_normalize(q_raw)] = str(ans).strip()
+    return ground_truth
+
+
+def judge_columns(csv_name):
+    """返回 (答案列, 原文列)；级联结果判 final_answer，原文优先取 S2"""
+    name = csv_name.lower()
+    is_s1 = "_s1" in name
+    ans_col = "final_answer" if "_cascade" in name else ("s1_answer" if is_s1 else "s2_answer")
+    return ans_col, ("s1_raw_output" if is_s1 else "s2_raw_output")
+
+
 # --- 2. 裁判逻辑 ---
-def llm_judge_si(client, question, model_ans, raw_out, correct_ans):
-    judge_prompt = (
-        "Determine if the 'Model Answer' is factually equivalent to the 'Standard Answer'.\n"
-        "Use 'Raw Output' for context. Output ONLY 'TRUE' or 'FALSE'."
-    )
-    user_content = f"Q: {question}\nTarget: {correct_ans}\nModel: {model_ans}\nFull: {raw_out}"
+JUDGE_PROMPT = (
+    "Determine if the 'Model Answer' is factually equivalent to the 'Standard Answer'.\n"
+    "Use 'Raw Output' for context. Output ONLY 'TRUE' or 'FALSE'."
+)
+
+
+JUDGE_BATCH_PROMPT = (
+    "For each item, determine if the 'Model' answer is factually equivalent to the 'Target' answer.\n"
+    "Use 'Full' (the raw model output) for context. Judge every item independently.\n"
+    "Output ONLY a JSON array of verdicts, one per item: [{\"id\": <item id>, \"verdict\": \"TRUE\" or \"FALSE\"}, ...]"
+)
+
+# 提示词内容的摘要作为版本号：改了提示词或切换逐条 / 批量判定，旧判定自动不再复用
+JUDGE_PROMPT_VERSION = hashlib.sha256(
+    (JUDGE_PROMPT + (JUDGE_BATCH_PROMPT if JUDGE_BATCH_SIZE > 1 else "")).encode("utf-8")).hexdigest()[:12]
+
+
+def is_placeholder_answer(model_ans):
+    """PARSE_ERR / 空 / 只有符号 (如 "**") 的答案：裁判只能凭该行的原始输出判定，结果不能跨行复用"""
+    norm = normalize_answer(model_ans or "")
+    return norm == "parse_err" or not re.search(r"\w", norm)
+
+
+def verdict_key(question, model_ans, correct_ans, raw_out=""):
+    """判定缓存键：(题目, 归一化后的模型答案, 标准答案, 裁判模型, 提示词版本)；占位答案另加原始输出的摘要"""
+    key = (super_normalize(question), normalize_answer(model_ans), correct_ans, JUDGE_MODEL, JUDGE_PROMPT_VERSION)
+    if is_placeholder_answer(model_ans):
+        key += (hashlib.sha256((raw_out or "").encode("utf-8")).hexdigest()[:16],)
+    return key
+
+
+def print_verdict_stats(stats):
+    todo = stats["rows"] - stats["judged"]
+    saved = stats["hits"] + stats["merged"]
+    print(f"\n⚖️ 裁判: 匹配 {stats['rows']} 行 | 已有判定 {stats['judged']} | 待判 {todo} | "
+          f"缓存命中 {stats['hits']} | 去重合并 {stats['merged']} | 送审 {stats['calls']} 条")
+    if stats["batches"]:
+        print(f"   📦 批量判定: {stats['batches']} 个请求 | 格式错误 / 缺项退回逐条 {stats['fallback']} 条")
+    if todo:
+        print(f"   判定缓存命中率 {stats['hits'] / todo:.1%} | 免调用比例 {saved / todo:.1%}")
+
+
+def judge_item(question, model_ans, raw_out, correct_ans):
+    return f"Q: {question}\nTarget: {correct_ans}\nModel: {model_ans}\nFull: {raw_out}"
+
+
+def judge_body(question, model_ans, raw_out, correct_ans):
+    """裁判请求体 (在线请求与批处理导出共用)"""
+    user_content = judge_item(question, model_ans, raw_out, correct_ans)
+    return {
+        "model": JUDGE_MODEL,
+        "messages": [{"role": "system", "content": JUDGE_PROMPT}, {"role": "user", "content": user_content}],
+        "max_tokens": 10, "temperature": 0
+    }
+
+
+def parse_verdict(text):
+    return "True" if "TRUE" in (text or "").strip().upper() else "False"
+
+
+async def llm_judge_si(client, question, model_ans, raw_out, correct_ans, retrier=None, ledger=None, source=""):
+    """返回 "True" / "False" / "ERROR"；预算用尽时返回 None (不送审)"""
+    if ledger and ledger.over_global_budget():
+        return None
+    body = judge_body(question, model_ans, raw_out, correct_ans)
     try:
-        response = client.chat.completions.create(
-            model="deepseek/deepseek-chat",
-            messages=[{"role": "system", "content": judge_prompt}, {"role": "user", "content": user_content}],
-            max_tokens=10, temperature=0, timeout=30
-        )
-        res = response.choices[0].message.content.strip().upper()
-        return "True" if "TRUE" in res else "False"
-    except:
+        response = await call_with_retry(retrier, (JUDGE_MODEL, "judge"),
+                                         lambda: client.chat.completions.create(**body, timeout=30))
+        if ledger and response.usage:
+            ledger.record(ledger.key_by_id.get(JUDGE_MODEL, JUDGE_MODEL), source, "judge",
+                          response.usage.prompt_tokens, response.usage.completion_tokens,
+                          cached_prompt_tokens(response.usage))
+        return parse_verdict(response.choices[0].message.content)
+    except Exception as e:
+        print(f"⚠️ Judge failed: {type(e).__name__}: {e}")
         return "ERROR"
 
 
+# --- 2.1 批量判定：一个请求判多条，输出按 id 对应的 JSON 数组 ---
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def pack_batches(items, max_items=JUDGE_BATCH_SIZE, context_tokens=JUDGE_CONTEXT_TOKENS):
+    """
+    items: [(question, model_ans, raw_out, correct_ans), ...]，返回下标分组。
+    按估算的 prompt + 判定数组输出 token 贪心装箱，不超过上下文的 3/4 (估算偏差留余量)
+    """
+    budget = context_tokens * 3 // 4 - _estimate_tokens(JUDGE_BATCH_PROMPT)
+    batches, current, used = [], [], 0
+    for i, item in enumerate(items):
+        cost = _estimate_tokens(judge_item(*item)) + JUDGE_VERDICT_TOKENS
+        if current and (len(current) >= max_items or used + cost > budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def judge_batch_body(items):
+    user_content = "\n\n".join(f"### Item {i}\n{judge_item(*item)}" for i, item in enumerate(items, 1))
+    return {
+        "model": JUDGE_MODEL,
+        "messages": [{"role": "system", "content": JUDGE_BATCH_PROMPT}, {"role": "user", "content": user_content}],
+        "max_tokens": JUDGE_VERDICT_TOKENS * len(items) + 16, "temperature": 0
+    }
+
+
+def parse_verdict_array(text, n):
+    """返回 {下标: "True"/"False"}；格式错误返回空 dict，缺项或判定不明的条目不出现在结果里"""
+    text = re.sub(r'```json\s*|```', '', text or "").strip()
+    try:
+        data = json.loads(text[text.index("["):text.rindex("]") + 1])
+    except ValueError:
+        return {}
+    verdicts = {}
+    for entry in data if isinstance(data, list) else []:
+        try:
+            i, verdict = int(entry["id"]) - 1, str(entry["verdict"]).strip().upper()
+        except (TypeError, KeyError, ValueError):
+            continue
+        if 0 <= i < n and verdict in ("TRUE", "FALSE"):
+            verdicts[i] = "True" if verdict == "TRUE" else "False"
+    return verdicts
+
+
+async def llm_judge_batch(client, items, retrier=None, ledger=None, source="", stats=None):
+    """一次请求判 len(items) 条；数组格式错误或缺项的条目退回 llm_judge_si 逐条补判。返回与 items 对齐的判定列表"""
+    if len(items) == 1:
+        return [await llm_judge_si(client, *items[0], retrier, ledger, source)]
+    if ledger and ledger.over_global_budget():
+        return [None] * len(items)
+    body = judge_batch_body(items)
+    verdicts = {}
+    try:
+        response = await call_with_retry(retrier, (JUDGE_MODEL, "judge"),
+                                         lambda: client.chat.completions.create(**body, timeout=60))
+        if ledger and response.usage:
+            ledger.record(ledger.key_by_id.get(JUDGE_MODEL, JUDGE_MODEL), source, "judge_batch",
+                          response.usage.prompt_tokens, response.usage.completion_tokens,
+                          cached_prompt_tokens(response.usage))
+        verdicts = parse_verdict_array(response.choices[0].message.content, len(items))
+    except Exception as e:
+        print(f"⚠️ Batch judge failed: {type(e).__name__}: {e}")
+
+    missing = [i for i in range(len(items)) if i not in verdicts]
+    if missing:
+        print(f"⚠️ 批量判定缺少 {len(missing)}/{len(items)} 项，逐条补判")
+    if stats is not None:
+        stats["batches"] += 1
+        stats["fallback"] += len(missing)
+    singles = await asyncio.gather(*(llm_judge_si(client, *items[i], retrier, ledger, source) for i in missing))
+    verdicts.update(zip(missing, singles))
+    return [verdicts[i] for i in range(len(items))]
+
+
 # --- 3. 主程序 ---
-def main():
+async def main_async():
     # A. 加载配置
     try:
         with open("Configs/API_KEY.yaml", "r", encoding="utf-8") as f:
-            api_key = yaml.safe_load(f).get("KEY")
+            key_cfg = yaml.safe_load(f)
+            api_key = key_cfg.get("KEY")
     except:
         return print("❌ 找不到 API Key")
+    base_url = os.environ.get("LLM_BASE_URL") or key_cfg.get("BASE_URL") or "https://openrouter.ai/api/v1"
 
-    client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
+    try:
+        with open("Configs/models.yaml", "r", encoding="utf-8") as f:
+            all_models = yaml.safe_load(f).get("models", {})
+    except Exception as e:
+        print(f"⚠️ models.yaml 读取失败，裁判走默认供应商且开销按 0 计价: {e}")
+        all_models = {}
+    limiters = AIMDRegistry({}, default_initial=JUDGE_CONCURRENCY)
+    client = build_client(all_models, limiters, api_key, base_url)  # 裁判模型按其 provider 路由
+    await client.warmup()
+    retrier = Retrier(hedge=HEDGE)
+    ledger = CostLedger(all_models, "judge", budget_usd=BUDGET_USD)
     results_base = Path("Results")
     si_json_path = Path("Data/si.json")
 
     # B. 加载标准答案库 (建立标准化索引)
-    ground_truth = {}
     if not si_json_path.exists():
         return print(f"❌ 找不到标准答案文件: {si_json_path}")
-
-    with open(si_json_path, 'r', encoding='utf-8') as j:
-        data = json.load(j)
-        for item in data:
-            # 兼容字段名：task 或 question
-            q_raw = item.get("task") or item.get("question")
-            ans = item.get("correct")
-            if q_raw:
-                # 键名进行超强标准化
-                ground_truth[super_normalize(q_raw)] = str(ans).strip()
+    ground_truth = load_ground_truth(si_json_path)
 
     print(f"✅ JSON 库加载成功，共 {len(ground_truth)} 条题目")
 
-    # C. 遍历处理 CSV
+    # C. 遍历 SI 结果：已有判定的行保留，其余先查判定缓存
+    verdicts = ResponseCache(VERDICT_CACHE_PATH) if USE_VERDICT_CACHE else None
+    files, pending, stats = [], defaultdict(list), Counter()  # pending: 判定键 -> 待判的行
     for csv_f in results_base.rglob("*.csv"):
         if "_si_" not in csv_f.name.lower() or "_completed" in csv_f.name:
             continue
 
-        is_s1 = "_s1" in csv_f.name.lower()
-        ans_col = "s1_answer" if is_s1 else "s2_answer"
-        raw_col = "s1_raw_output" if is_s1 else "s2_raw_output"
+        ans_col, raw_col = judge_columns(csv_f.name)
 
         rows = []
         with open(csv_f, "r", encoding="utf-8-sig") as f:
@@ -86,10 +269,10 @@ def main():
             if "correct" not in fieldnames: fieldnames.append("correct")
             if "T_F" not in fieldnames: fieldnames.append("T_F")
             rows = list(reader)
+        files.append((csv_f, fieldnames, rows))
 
         print(f"\n📂 正在处理: {csv_f.name}")
 
-        tasks_to_judge = []
         match_failed_count = 0
 
         for row in rows:
@@ -108,33 +291,71 @@ def main():
                     print(f"JSON 库样例: [{list(ground_truth.keys())[0][:50]}...]")
                 row["correct"] = "NOT_FOUND"
                 row["T_F"] = "N/A"
+                continue
+
+            row["correct"] = correct_ans
+            stats["rows"] += 1
+            raw_out = row[raw_col] or row.get("s1_raw_output", "")
+            key = ResponseCache.key(*verdict_key(row["task"], row[ans_col], correct_ans, raw_out))
+            if row.get("T_F") in ("True", "False"):
+                stats["judged"] += 1  # 已判定的行不再送审，顺便补进判定缓存
+                if verdicts and verdicts.get(key) is None:
+                    verdicts.put(key, {"verdict": row["T_F"]})
+                continue
+            cached = verdicts.get(key) if verdicts else None
+            if cached:
+                row["T_F"] = cached["verdict"]
+                stats["hits"] += 1
             else:
-                row["correct"] = correct_ans
-                tasks_to_judge.append(row)
+                pending[key].append((row, ans_col, raw_col, csv_f.stem))
 
         if match_failed_count > 0:
             print(f"❌ 该文件有 {match_failed_count} 行题目匹配失败，请检查文本差异！")
 
-        # D. 执行 API 判定
-        if tasks_to_judge:
-            print(f"🧠 发送 {len(tasks_to_judge)} 条请求至 DeepSeek-V3...")
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                future_to_row = {
-                    executor.submit(
-                        llm_judge_si, client, r["task"], r[ans_col], r[raw_col], r["correct"]
-                    ): r for r in tasks_to_judge
-                }
-                for fut in as_completed(future_to_row):
-                    future_to_row[fut]["T_F"] = fut.result()
-
-        # E. 写回文件
+    # D. 执行 API 判定：判定键相同的行 (不同模型给出同一答案) 只送审一次，再按 JUDGE_BATCH_SIZE 打包
+    if pending:
+        groups = list(pending.values())
+        heads = [group[0] for group in groups]
+        items = [(r["task"], r[ans_col], r[raw_col] or r.get("s1_raw_output", ""), r["correct"])
+                 for r, ans_col, raw_col, _ in heads]
+        batches = pack_batches(items) if JUDGE_BATCH_SIZE > 1 else [[i] for i in range(len(items))]
+        print(f"\n🧠 发送 {len(items)} 条判定 ({len(batches)} 个请求) 至 DeepSeek-V3...")
+        batch_verdicts = await asyncio.gather(*(
+            llm_judge_batch(client, [items[i] for i in batch], retrier, ledger,
+                            "+".join(sorted({heads[i][3] for i in batch})), stats) for batch in batches
+        ))
+        results = [None] * len(items)
+        for batch, verdicts_ in zip(batches, batch_verdicts):
+            for i, verdict in zip(batch, verdicts_):
+                results[i] = verdict
+        for key, group, verdict in zip(pending, groups, results):
+            if verdict is None:
+                continue
+            if verdicts and verdict in ("True", "False"):
+                verdicts.put(key, {"verdict": verdict})
+            for r, *_ in group:
+                r["T_F"] = verdict
+    stats["calls"] = len(pending)  # 待判定的不同条目数
+    stats["merged"] = sum(len(group) - 1 for group in pending.values())
+
+    # E. 写回文件
+    for csv_f, fieldnames, rows in files:
         with open(csv_f, "w", newline="", encoding="utf-8-sig") as f:
             writer = csv.DictWriter(f, fieldnames=fieldnames)
             writer.writeheader()
             writer.writerows(rows)
 
+    print_verdict_stats(stats)
+    ledger.save()
+    print_limits(limiters)
+    print_retry_stats(retrier)
+    print_ledger(ledger)
     print("\n✨ 任务结束")
 
 
+def main():
+    asyncio.run(main_async())
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
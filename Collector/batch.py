@@ -0,0 +1,120 @@
+import json
+import random
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from Collector.mock_server import canned_answer, structured_answer, fake_logprobs, _count_tokens, _text
+from Collector.providers import cached_prompt_tokens
+
+
+BATCH_DIR = Path("Batch")
+MAX_LINES = 50_000  # 单个批处理输入文件的请求数上限 (OpenAI Batch API 限制)
+ENDPOINT = "/v1/chat/completions"
+
+
+# --- 1. 导出：OpenAI Batch JSONL ---
+def batch_line(custom_id, body):
+    return {"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}
+
+
+def write_batch(lines, manifest, name=None, batch_dir=BATCH_DIR):
+    """
+    按 MAX_LINES 切分写出 <name>_NNN.jsonl，另写 <name>.manifest.json 记录每个 custom_id 的回写信息。
+    返回 (输入文件列表, manifest 路径)
+    """
+    name = name or time.strftime("batch_%Y%m%d-%H%M%S")
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for part, start in enumerate(range(0, len(lines), MAX_LINES), 1):
+        path = batch_dir / f"{name}_{part:03d}.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            for line in lines[start:start + MAX_LINES]:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        paths.append(path)
+
+    manifest_path = batch_dir / f"{name}.manifest.json"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    return paths, manifest_path
+
+
+# --- 2. 导入：批处理输出 ---
+def read_results(paths):
+    """读取批处理输出文件，返回 ({custom_id: 响应 body}, 失败数)"""
+    bodies, failed = {}, 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip(): continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    failed += 1
+                    continue
+                bodies[item["custom_id"]] = response["body"]
+    return bodies, failed
+
+
+def payload_from_body(body):
+    """批处理响应 -> 与在线请求相同格式的缓存 payload；批处理没有单请求延迟，延迟类字段留空"""
+    choices = body["choices"]
+    usage = body.get("usage") or {}
+    return {
+        "contents": [c["message"]["content"] for c in choices],
+        "logprobs": [[(t["token"], t["logprob"]) for t in c["logprobs"]["content"]]
+                     if (c.get("logprobs") or {}).get("content") else None for c in choices],
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "cached_tokens": cached_prompt_tokens(usage),
+        "latency_ms": "",
+        "ttft_ms": "",
+        "tokens_per_s": "",
+        "stop_reason": choices[0].get("finish_reason", "")
+    }
+
+
+# --- 3. 本地假批处理 (测试用) ---
+def fake_process(input_path, output_path, disagree=0.1, p_garbage=0.0, p_error=0.0, seed=None):
+    """逐行用 mock_server 的固定格式回答生成批处理输出文件；p_error 为单条请求失败的概率"""
+    rng_state = random.getstate()
+    if seed is not None:
+        random.seed(seed)
+    cfg = SimpleNamespace(disagree=disagree, p_garbage=p_garbage)
+    count = 0
+    try:
+        with open(input_path, "r", encoding="utf-8") as fin, open(output_path, "w", encoding="utf-8") as fout:
+            for i, line in enumerate(fin):
+                if not line.strip(): continue
+                req = json.loads(line)
+                fout.write(json.dumps(_fake_result(i, req, cfg, p_error), ensure_ascii=False) + "\n")
+                count += 1
+    finally:
+        if seed is not None:
+            random.setstate(rng_state)
+    return count
+
+
+def _fake_result(i, req, cfg, p_error):
+    result = {"id": f"batch_req_{i}", "custom_id": req["custom_id"], "response": None, "error": None}
+    if random.random() < p_error:
+        result["error"] = {"code": "server_error", "message": "fake batch failure"}
+        return result
+
+    body = req["body"]
+    messages = body.get("messages", [])
+    system = next((_text(m["content"]) for m in messages if m.get("role") == "system"), "")
+    user = next((_text(m["content"]) for m in reversed(messages) if m.get("role") == "user"), "")
+    answer = structured_answer if body.get("response_format") else canned_answer
+    contents = [answer(system, user, cfg) for _ in range(int(body.get("n") or 1))]
+    prompt_tokens = _count_tokens("".join(_text(m.get("content")) for m in messages))
+    completion_tokens = sum(_count_tokens(c) for c in contents)
+    result["response"] = {"status_code": 200, "request_id": f"req_{i}", "body": {
+        "id": f"chatcmpl-batch-{i}", "object": "chat.completion", "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": j, "message": {"role": "assistant", "content": c}, "finish_reason": "stop",
+                     "logprobs": fake_logprobs(c) if body.get("logprobs") else None}
+                    for j, c in enumerate(contents)],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens}
+    }}
+    return result
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+
+CACHE_PATH = Path("Cache/responses.sqlite")
+CACHE_MAX_MB = 2048
+
+
+# --- 内容寻址的 LLM 响应缓存 (SQLite) ---
+class ResponseCache:
+    """
+    键 = sha256(模型 id, system 指令, user 消息, temperature, max_tokens, 采样序号, ...)
+    值 = 原始 completion 文本 + usage + 当时的 latency_ms，命中时原样回放。
+    总大小超过 max_mb 时按最近访问时间 (LRU) 淘汰到 90%。
+    """
+
+    def __init__(self, path=CACHE_PATH, max_mb=CACHE_MAX_MB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, payload TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def key(*fields):
+        raw = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT payload FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key, payload):
+        data = json.dumps(payload, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        now = time.time()
+        old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, payload, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, data, size, now, now)
+        )
+        self.conn.commit()
+        self.total_bytes += size - (old[0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            doomed.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.conn.commit()
+        self.evicted += len(doomed)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size_mb": round(self.total_bytes / 1024 / 1024, 2)}
+
+    def close(self):
+        self.conn.close()
+
+
+async def fetch(cache, key_fields, request):
+    """先查缓存，未命中再调用 request() 并写入。返回 (payload, 是否命中)"""
+    if cache is None:
+        return await request(), False
+    key = cache.key(*key_fields)
+    payload = cache.get(key)
+    if payload is not None:
+        return payload, True
+    payload = await request()
+    cache.put(key, payload)
+    return payload, False
+
+
+def print_cache_stats(cache):
+    s = cache.stats()
+    print(f"\n💾 响应缓存: hits={s['hits']} | misses={s['misses']} | hit_rate={s['hit_rate']:.1%} | "
+          f"evicted={s['evicted']} | size={s['size_mb']}MB")
@@ -0,0 +1,176 @@
+import csv
+import json
+import yaml
+from collections import Counter, defaultdict
+from pathlib import Path
+from Collector.scheduler import Scheduler, print_report
+from Collector.sink import ResultSink
+from Collector.index import CompletionIndex
+from Collector.ledger import print_ledger
+
+
+# --- 1. 供应商配置 ---
+def load_providers(config_path=Path("Configs/models.yaml")):
+    """读取 models.yaml 顶层的 providers 段 (供应商级并发上限等)"""
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f).get("providers", {}) or {}
+    except Exception as e:
+        print(f"⚠️ 供应商配置读取失败，使用默认上限: {e}")
+        return {}
+
+
+# --- 2. 数据与断点续跑 ---
+def load_tasks(json_f):
+    with open(json_f, 'r', encoding='utf-8') as j:
+        return [{"id": i, "question": (item.get("task") or item.get("question"))}
+                for i, item in enumerate(json.load(j))]
+
+
+def load_completed_ids(file_path):
+    """优先读 sidecar 完成索引，只有索引缺失或过期时才重扫 CSV"""
+    return CompletionIndex.load(file_path).ids
+
+
+def prepare_output(file_path, fieldnames):
+    """
+    表头演进：旧文件缺少新增列时整体重写一次，旧行新列留空；
+    已有的额外列 (如 correct / T_F) 保持原位。返回实际写入用的表头。
+    """
+    if not file_path.exists() or file_path.stat().st_size == 0:
+        return list(fieldnames)
+
+    with open(file_path, "r", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        existing = list(reader.fieldnames or [])
+        missing = [c for c in fieldnames if c not in existing]
+        if not missing:
+            return existing
+        rows = list(reader)
+
+    merged = existing + missing
+    with open(file_path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=merged)
+        writer.writeheader()
+        writer.writerows(rows)
+    return merged
+
+
+# --- 3. 跨数据集去重 ---
+def normalize_question(question):
+    """去重用的题面归一化：只折叠空白，大小写与标点会改变模型看到的提示，保持原样"""
+    return " ".join(str(question).split())
+
+
+def dedup_jobs(jobs):
+    """
+    同一 (系统, 模型, 题面) 只派发一次：保留首个作业，其余挂在它的 fanout 上，结果出来后按各自的行 id 写回。
+    同一次运行内每个系统的请求参数固定，题面相同即请求相同。返回 (待派发作业, 被合并的作业数)
+    """
+    primary, merged = {}, 0
+    for job in jobs:
+        key = (job["system"], job["model_id"], normalize_question(job["task"]["question"]))
+        if key in primary:
+            primary[key].setdefault("fanout", []).append(job)
+            merged += 1
+        else:
+            primary[key] = job
+    return list(primary.values()), merged
+
+
+# --- 4. 全量采集 (全局调度：数据集 × 模型 × 任务 × 系统) ---
+def build_jobs(system, banner, run_task, fieldnames, all_models,
+               data_dir=Path("Data"), results_base=Path("Results")):
+    """
+    system: 输出文件后缀 (s1 / s2)
+    banner: 启动提示前缀，例如 "🚀 Running S1"
+    run_task: async (task_id, question, model_id, client) -> row | None
+    """
+    jobs = []
+    for json_f in data_dir.glob("*.json"):
+        dataset_name = json_f.stem
+        tasks = load_tasks(json_f)
+
+        for model_key, info in all_models.items():
+            file_path = results_base / model_key / "Splits" / f"{model_key}_{dataset_name}_{system}.csv"
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+
+            completed_ids = load_completed_ids(file_path)
+            todo_tasks = [t for t in tasks if t["id"] not in completed_ids]
+            if not todo_tasks: continue
+
+            print(f"{banner}: {model_key} | Dataset: {dataset_name} | Tasks: {len(todo_tasks)}")
+            out_fields = prepare_output(file_path, fieldnames)
+            CompletionIndex(file_path, completed_ids).save()  # 表头可能被重写，同步索引记录的文件大小
+            for t in todo_tasks:
+                jobs.append({
+                    "system": system, "dataset": dataset_name, "model_key": model_key,
+                    "model_id": info['id'], "task": t, "run_task": run_task,
+                    "file_path": file_path, "fieldnames": out_fields
+                })
+    return jobs
+
+
+def parsed_answers(res):
+    """行内各系统的解析结果：S1 取全部采样 (_sample_answers)，S2 / 级联取答案列"""
+    if "_sample_answers" in res:
+        yield "s1", res["_sample_answers"]
+    elif res.get("s1_answer"):
+        yield "s1", [res["s1_answer"]]
+    if res.get("s2_answer"):
+        yield "s2", [res["s2_answer"]]
+
+
+async def execute_job(job, client, sink, ledger=None, dedup_stats=None, parse_stats=None):
+    t = job["task"]
+    res = await job["run_task"](t["id"], t["question"], job["model_id"], client)
+    if not res:
+        return
+    # _billed: 本次实际付费的 (prompt, completion[, cached_prompt]) tokens，缓存回放为 0；缺省时按行内用量记账
+    billed = res.get("_billed") or (res.get("prompt_tokens"), res.get("completion_tokens"))
+    if ledger:
+        ledger.record(job["model_key"], job["dataset"], job["system"], *billed)
+    if parse_stats is not None:
+        # 每个 PARSE_ERR 都是一次付了费却没有产出的调用
+        for system, answers in parsed_answers(res):
+            parse_stats[(job["model_key"], system)]["answers"] += len(answers)
+            parse_stats[(job["model_key"], system)]["errors"] += sum(a == "PARSE_ERR" for a in answers)
+    # 下划线开头的键只在内存中传递，不写入 CSV
+    row = {k: v for k, v in res.items() if not k.startswith("_")}
+    sink.write(job["file_path"], job["fieldnames"], row)
+    for dup in job.get("fanout", []):
+        sink.write(dup["file_path"], dup["fieldnames"], {**row, "id": dup["task"]["id"], "task": dup["task"]["question"]})
+        if dedup_stats is not None:
+            dedup_stats["rows"] += 1
+            dedup_stats["requests"] += res.get("_calls", 1)  # 该结果实际发出的请求数 (S1 多次采样 / 级联含 S2)
+
+
+async def run_jobs(jobs, all_models, client, fsync=False, ledger=None, budget_mode="stop", dedup=True):
+    if dedup:
+        jobs, merged = dedup_jobs(jobs)
+        if merged:
+            print(f"🧬 跨数据集去重: 合并 {merged} 个重复题目，派发 {len(jobs)} 个作业")
+    dedup_stats, parse_stats = Counter(), defaultdict(Counter)
+    scheduler = Scheduler(all_models, load_providers(), ledger=ledger, budget_mode=budget_mode)
+    for job in jobs:
+        scheduler.submit(job)
+    sink = ResultSink(fsync=fsync).start()
+    try:
+        stats = await scheduler.run(lambda job: execute_job(job, client, sink, ledger, dedup_stats, parse_stats))
+    finally:
+        sink.close()
+        if ledger:
+            ledger.save()
+    stats["dedup"] = dict(dedup_stats)
+    stats["parse"] = {key: dict(c) for key, c in sorted(parse_stats.items())}
+    print_report(stats)
+    print(f"🗂️ 写入 {sink.rows_written} 行 | 刷盘 {sink.flushes} 次")
+    if ledger:
+        print_ledger(ledger)
+    return stats
+
+
+async def sweep(system, banner, run_task, fieldnames, all_models, client, data_dir=Path("Data"),
+                results_base=Path("Results"), fsync=False, ledger=None, budget_mode="stop", dedup=True):
+    jobs = build_jobs(system, banner, run_task, fieldnames, all_models, data_dir, results_base)
+    return await run_jobs(jobs, all_models, client, fsync=fsync, ledger=ledger, budget_mode=budget_mode, dedup=dedup)
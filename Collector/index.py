@@ -0,0 +1,69 @@
+import csv
+import os
+import struct
+
+
+MAGIC = b"CIDX1"
+_HEADER = struct.Struct("<5sQ")  # magic, 对应 CSV 的字节数
+
+
+# --- 结果文件的完成索引 (sidecar 位图) ---
+class CompletionIndex:
+    """
+    每个结果 CSV 旁边一个 <name>.csv.idx：记录已完成 task id 的位图和写入时 CSV 的大小。
+    大小一致时直接信任位图，续跑不再解析 CSV；不一致 (崩溃、手工改表、裁判回写) 时重扫一次并重建。
+    写入先落临时文件再 os.replace，保证索引本身是原子更新的。
+    """
+
+    def __init__(self, csv_path, ids=None):
+        self.csv_path = csv_path
+        self.path = csv_path.with_name(csv_path.name + ".idx")
+        self.ids = set(ids or ())
+
+    @classmethod
+    def load(cls, csv_path):
+        index = cls(csv_path)
+        if not csv_path.exists():
+            return index
+        if not index._read():
+            index.ids = scan_completed_ids(csv_path)
+            index.save()
+        return index
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            magic, csv_size = _HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return False
+        if magic != MAGIC or csv_size != self.csv_path.stat().st_size:
+            return False
+
+        bitmap = data[_HEADER.size:]
+        self.ids = {i * 8 + b for i, byte in enumerate(bitmap) if byte for b in range(8) if byte >> b & 1}
+        return True
+
+    def add(self, ids):
+        self.ids.update(ids)
+
+    def save(self, csv_size=None):
+        if csv_size is None:
+            csv_size = self.csv_path.stat().st_size if self.csv_path.exists() else 0
+        bitmap = bytearray((max(self.ids) // 8 + 1) if self.ids else 0)
+        for i in self.ids:
+            bitmap[i // 8] |= 1 << (i % 8)
+
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, csv_size))
+            f.write(bitmap)
+        os.replace(tmp, self.path)
+
+
+def scan_completed_ids(csv_path):
+    completed_ids = set()
+    with open(csv_path, "r", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        for row in reader: completed_ids.add(int(row["id"]))
+    return completed_ids
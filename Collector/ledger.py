@@ -0,0 +1,106 @@
+import csv
+import time
+from collections import defaultdict
+from pathlib import Path
+
+
+LEDGER_PATH = Path("Results/cost_ledger.csv")
+LEDGER_FIELDS = [
+    "run_id", "run_kind", "model_key", "dataset", "system",
+    "rows", "prompt_tokens", "completion_tokens", "cached_prompt_tokens", "cost_usd"
+]
+
+
+def token_count(value):
+    """CSV / 响应里的 token 字段转 int；空值 (如流式提前断开没有 usage) 记 0"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+# --- Token / 费用账本 ---
+class CostLedger:
+    """
+    按 (模型, 数据集, 系统) 累计本次运行实际付费的 token 与美元开销 (缓存回放不计费)。
+    价格取 models.yaml 中每个模型的 price: {prompt, completion}，单位 USD / 1M tokens；
+    命中供应商前缀缓存的 prompt tokens 按 price.cached_prompt 计价 (缺省同 prompt)。
+    budget_usd / budget_tokens 为全局预算，模型级预算取 models.yaml 的 budget_usd；
+    预算按已记账的开销判断，在途请求可能让实际开销略超预算。
+    price_scale 为整体价格系数 (如批处理接口半价时取 0.5)。
+    """
+
+    def __init__(self, all_models, run_kind, budget_usd=None, budget_tokens=None, path=LEDGER_PATH,
+                 price_scale=1.0):
+        self.run_kind = run_kind
+        self.price_scale = price_scale
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self.path = Path(path)
+        self.budget_usd = budget_usd
+        self.budget_tokens = budget_tokens
+        self.prices = {k: info.get("price", {}) or {} for k, info in all_models.items()}
+        self.model_budget_usd = {k: info.get("budget_usd") for k, info in all_models.items()}
+        self.key_by_id = {info["id"]: k for k, info in all_models.items()}
+        self.entries = defaultdict(lambda: {"rows": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                            "cached_prompt_tokens": 0, "cost_usd": 0.0})
+
+    def cost(self, model_key, prompt_tokens, completion_tokens, cached_tokens=0):
+        price = self.prices.get(model_key, {})
+        prompt_price = float(price.get("prompt", 0))
+        cached_tokens = min(cached_tokens, prompt_tokens)
+        return ((prompt_tokens - cached_tokens) * prompt_price
+                + cached_tokens * float(price.get("cached_prompt", prompt_price))
+                + completion_tokens * float(price.get("completion", 0))) * self.price_scale / 1_000_000
+
+    def record(self, model_key, dataset, system, prompt_tokens, completion_tokens, cached_tokens=0):
+        prompt_tokens, completion_tokens = token_count(prompt_tokens), token_count(completion_tokens)
+        cached_tokens = token_count(cached_tokens)
+        entry = self.entries[(model_key, dataset, system)]
+        entry["rows"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["cached_prompt_tokens"] += cached_tokens
+        entry["cost_usd"] += self.cost(model_key, prompt_tokens, completion_tokens, cached_tokens)
+
+    # --- 汇总与预算判断 ---
+    def total_usd(self, model_key=None):
+        return sum(e["cost_usd"] for (m, _, _), e in self.entries.items() if model_key in (None, m))
+
+    def total_tokens(self):
+        return sum(e["prompt_tokens"] + e["completion_tokens"] for e in self.entries.values())
+
+    def over_global_budget(self):
+        return ((self.budget_usd is not None and self.total_usd() >= self.budget_usd)
+                or (self.budget_tokens is not None and self.total_tokens() >= self.budget_tokens))
+
+    def over_model_budget(self, model_key):
+        budget = self.model_budget_usd.get(model_key)
+        return budget is not None and self.total_usd(model_key) >= budget
+
+    # --- 持久化 ---
+    def save(self):
+        if not self.entries:
+            return
+        from Collector.engine import prepare_output
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not self.path.exists() or self.path.stat().st_size == 0
+        fieldnames = prepare_output(self.path, LEDGER_FIELDS)  # 旧账本缺少新增列时补齐表头
+        with open(self.path, "a", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            if is_new: writer.writeheader()
+            for (model_key, dataset, system), e in sorted(self.entries.items()):
+                writer.writerow({"run_id": self.run_id, "run_kind": self.run_kind, "model_key": model_key,
+                                 "dataset": dataset, "system": system, **e, "cost_usd": round(e["cost_usd"], 6)})
+
+
+def print_ledger(ledger):
+    per_model = defaultdict(float)
+    for (model_key, _, _), e in ledger.entries.items():
+        per_model[model_key] += e["cost_usd"]
+    print(f"\n💰 本次开销 ({ledger.run_kind}): ${ledger.total_usd():.4f} | tokens={ledger.total_tokens()}")
+    prompt = sum(e["prompt_tokens"] for e in ledger.entries.values())
+    cached = sum(e["cached_prompt_tokens"] for e in ledger.entries.values())
+    if prompt:
+        print(f"   ♻️ 前缀缓存命中: {cached} / {prompt} prompt tokens ({cached / prompt:.1%})")
+    for model_key, usd in sorted(per_model.items(), key=lambda x: -x[1]):
+        print(f"   {model_key}: ${usd:.4f}")
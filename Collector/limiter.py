@@ -0,0 +1,229 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+import httpx
+from Collector.nettrace import current_timings, make_trace
+
+AIMD_MAX_FACTOR = 4  # 未配置 aimd.max 时，并发最多增长到初始值的倍数
+
+
+# --- 1. AIMD 并发控制器 (每个模型端点一个) ---
+class AIMDLimiter:
+    """
+    加性增 / 乘性减：
+    - 成功且延迟健康：每个成功请求 +increase/limit (约每轮 RTT +increase)
+    - 最近 window 个请求里 429 / 5xx / 超时占比超过 error_threshold：limit *= decrease，
+      每个 RTT (同类请求的基线延迟，上限 max_cooldown_s) 内只减一次；零星的随机错误不会把并发打到底
+    - 近期延迟 (快 EWMA) 明显高于基线 (慢 EWMA)：limit *= latency_decrease
+    """
+
+    def __init__(self, name, initial, min_limit=1, max_limit=None, increase=1.0, decrease=0.5,
+                 error_threshold=0.1, window=50, latency_factor=2.0, latency_decrease=0.9,
+                 max_cooldown_s=5.0, on_event=None):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit or initial * AIMD_MAX_FACTOR
+        self.increase = increase
+        self.decrease = decrease
+        self.error_threshold = error_threshold
+        self.latency_factor = latency_factor
+        self.latency_decrease = latency_decrease
+        self.max_cooldown_s = max_cooldown_s
+        self.on_event = on_event
+
+        self.inflight = 0
+        self.successes = 0
+        self.errors = 0
+        self.backoffs = 0
+        self.outcomes = deque(maxlen=window)  # True = 需要退让的失败
+        self.latency_fast = {}  # 按 max_tokens 分类：S1/S2/裁判请求的延迟量级不同
+        self.latency_slow = {}
+        self._last_cut = 0.0
+        self._cond = None
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.inflight < max(int(self.limit), self.min_limit))
+            self.inflight += 1
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self.inflight -= 1
+            cond.notify(max(int(self.limit) - self.inflight, 1))
+
+    def _cooldown_s(self, kind):
+        rtt_ms = self.latency_slow.get(kind) or max(self.latency_slow.values(), default=1000.0)
+        return min(self.max_cooldown_s, max(0.05, rtt_ms / 1000))
+
+    def _cut(self, factor, reason, kind=None):
+        now = time.monotonic()
+        if now - self._last_cut < self._cooldown_s(kind):
+            return
+        self._last_cut = now
+        old = self.limit
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.backoffs += 1
+        if self.on_event:
+            self.on_event({"t": time.time(), "model": self.name, "reason": reason,
+                           "old": round(old, 1), "new": round(self.limit, 1)})
+
+    def on_success(self, latency_ms, kind=None):
+        self.successes += 1
+        self.outcomes.append(False)
+        fast = self.latency_fast.get(kind, latency_ms) * 0.7 + latency_ms * 0.3
+        slow = self.latency_slow.get(kind, latency_ms) * 0.98 + latency_ms * 0.02
+        self.latency_fast[kind], self.latency_slow[kind] = fast, slow
+
+        if fast > self.latency_factor * slow:
+            self._cut(self.latency_decrease, "latency", kind)
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase / max(self.limit, 1.0))
+
+    def on_failure(self, reason, kind=None):
+        self.errors += 1
+        self.outcomes.append(True)
+        if len(self.outcomes) >= 10 and sum(self.outcomes) / len(self.outcomes) >= self.error_threshold:
+            self._cut(self.decrease, reason, kind)
+
+    def snapshot(self):
+        return {"limit": round(self.limit, 1), "inflight": self.inflight, "successes": self.successes,
+                "errors": self.errors, "backoffs": self.backoffs}
+
+
+def classify_status(status_code):
+    """需要退让的响应状态：429 限流 / 5xx 服务端错误"""
+    if status_code == 429:
+        return "429"
+    if status_code >= 500:
+        return f"{status_code}"
+    return None
+
+
+# --- 2. 注册表：models.yaml 中每个模型一个控制器，按请求体里的 model id 路由 ---
+def aimd_bounds(info, default_initial=16):
+    """models.yaml 模型配置 -> (initial, min, max)；调度器按 max 设槽位上限，加性增长才不会被调度器截住"""
+    aimd = info.get("aimd", {}) or {}
+    initial = aimd.get("initial", info.get("max_concurrency", default_initial))
+    return initial, aimd.get("min", 1), aimd.get("max") or initial * AIMD_MAX_FACTOR
+
+
+class AIMDRegistry:
+    def __init__(self, all_models, default_initial=16, on_event=None):
+        self.on_event = on_event or self._log_event
+        self.events = deque(maxlen=1000)
+        self.default_initial = default_initial
+        self.limiters = {}
+        for info in all_models.values():
+            initial, min_limit, max_limit = aimd_bounds(info, default_initial)
+            self.limiters[info["id"]] = AIMDLimiter(info["id"], initial, min_limit=min_limit, max_limit=max_limit,
+                                                    on_event=self._record)
+
+    def _record(self, event):
+        self.events.append(event)
+        self.on_event(event)
+
+    @staticmethod
+    def _log_event(event):
+        print(f"⚠️ [AIMD] {event['model']} 并发 {event['old']} → {event['new']} ({event['reason']})")
+
+    def get(self, model_id):
+        if model_id not in self.limiters:
+            self.limiters[model_id] = AIMDLimiter(model_id, self.default_initial, on_event=self._record)
+        return self.limiters[model_id]
+
+    def snapshot(self):
+        return {model_id: lim.snapshot() for model_id, lim in self.limiters.items()}
+
+    def http_client(self, **kwargs):
+        """给 AsyncOpenAI(http_client=...) 用的 httpx 客户端，所有请求经过 AIMD 闸门"""
+        kwargs.setdefault("follow_redirects", True)
+        return httpx.AsyncClient(transport=AIMDTransport(self, kwargs.pop("transport", None)), **kwargs)
+
+
+def print_limits(registry):
+    print("\n🎚️ AIMD 并发状态:")
+    for model_id, s in registry.snapshot().items():
+        print(f"   {model_id}: limit={s['limit']} | ok={s['successes']} | err={s['errors']} | backoffs={s['backoffs']}")
+
+
+# --- 3. httpx 传输层：按模型限流并观测 429/5xx/超时 (含 SDK 内部重试) ---
+class _ReleasingStream(httpx.AsyncByteStream):
+    """响应体读完/关闭时才归还槽位，流式响应也能正确计数"""
+
+    def __init__(self, stream, limiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._released = False
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except httpx.TimeoutException:
+            self._limiter.on_failure("timeout")
+            raise
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                await self._limiter.release()
+
+
+class AIMDTransport(httpx.AsyncBaseTransport):
+    def __init__(self, registry, transport=None):
+        self.registry = registry
+        self.transport = transport or httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100))
+
+    async def handle_async_request(self, request):
+        try:
+            body = json.loads(request.content or b"{}")
+        except (ValueError, httpx.RequestNotRead):
+            body = {}
+        if not isinstance(body, dict) or "model" not in body:
+            return await self.transport.handle_async_request(request)
+
+        limiter = self.registry.get(body["model"])
+        timings = current_timings()
+        if timings is not None:
+            request.extensions["trace"] = make_trace(timings)
+        queued = time.perf_counter()
+        await limiter.acquire()
+        start = time.perf_counter()
+        if timings is not None:
+            timings["queue_ms"] = int((start - queued) * 1000)  # 在 AIMD 闸门前排队的时间
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException as e:
+            if isinstance(e, httpx.TimeoutException):
+                limiter.on_failure("timeout", body.get("max_tokens"))
+            await limiter.release()
+            raise
+
+        reason = classify_status(response.status_code)
+        if reason:
+            limiter.on_failure(reason, body.get("max_tokens"))
+        elif response.status_code < 400:
+            limiter.on_success((time.perf_counter() - start) * 1000, body.get("max_tokens"))
+        if response.is_closed:
+            # 响应体已预先读完 (如内存中的假响应)，直接归还槽位
+            await limiter.release()
+        else:
+            response.stream = _ReleasingStream(response.stream, limiter)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,252 @@
+"""
+本地 OpenAI 兼容假服务，用于离线压测采集链路 (调度 / AIMD / 重试 / 解析)，不花钱。
+
+    python -m Collector.mock_server --port 8765 --latency lognormal:800:0.6 --p429 0.02 --p5xx 0.01
+    LLM_BASE_URL=http://127.0.0.1:8765/v1 python RUNS_ALL.py
+
+注意：采集脚本按相对路径写 Results/，压测请在复制了 Configs/ 与 Data/ 的临时目录里跑
+(PYTHONPATH 指向仓库根目录)，避免假数据混入真实结果。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import re
+import random
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+
+# --- 1. 延迟分布 ---
+def parse_latency(spec):
+    """fixed:MS | uniform:LO:HI | lognormal:MEDIAN_MS:SIGMA，返回采样函数 (毫秒)"""
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        mu = math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1])
+    raise ValueError(f"未知延迟分布: {spec}")
+
+
+# --- 2. 固定格式的假回答 ---
+def _count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _text(content):
+    """content 可能是字符串，也可能是 content parts 列表 (带 cache_control 的 system 消息)"""
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return content or ""
+
+
+def canned_answer(system, user, cfg):
+    seed = int(hashlib.md5(user.encode("utf-8")).hexdigest()[:8], 16)
+    answer = str(seed % 97)
+    if random.random() < cfg.disagree:
+        answer = str(random.randint(0, 96))
+    confidence = 60 + seed % 40
+
+    if random.random() < cfg.p_garbage:
+        return "I think the answer depends on several factors that need careful thought"
+    if "Final Answer" in system:
+        return (f"Reasoning: Let the unknown be x and check the intuitive answer against the constraints.\n"
+                f"Final Answer: {answer} | {confidence}")
+    if "verdicts" in system:  # 批量裁判：按 ### Item N 返回判定数组
+        ids = re.findall(r"^### Item (\d+)", user, re.M)
+        return json.dumps([{"id": int(i), "verdict": "TRUE" if (seed + int(i)) % 3 else "FALSE"} for i in ids])
+    if "TRUE" in system and "FALSE" in system:
+        return "TRUE" if seed % 3 else "FALSE"
+    return json.dumps({"answer": answer, "confidence": confidence})
+
+
+def structured_answer(system, user, cfg):
+    """response_format 模式：同样的答案，但总是合法 JSON (S2 为 {reasoning, answer, confidence})"""
+    text = canned_answer(system, user, SimpleNamespace(disagree=cfg.disagree, p_garbage=0.0))
+    if "Final Answer" not in system:
+        return text
+    reasoning, _, final = text.partition("Final Answer:")
+    answer, _, confidence = final.partition("|")
+    return json.dumps({"reasoning": reasoning.replace("Reasoning:", "").strip(), "answer": answer.strip(),
+                       "confidence": int(confidence)})
+
+
+def fake_logprobs(content):
+    """按 4 个字符切 token，logprob 随机：约一半回答很笃定，另一半较犹豫"""
+    scale = random.choice([0.05, 0.8])
+    tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+    return {"content": [{"token": t, "logprob": -random.expovariate(1 / scale), "bytes": None, "top_logprobs": []}
+                        for t in tokens]}
+
+
+# --- 3. HTTP/1.1 处理 (keep-alive + SSE 流式) ---
+class MockServer:
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.latency = parse_latency(cfg.latency)
+        self.stats = Counter()
+        self.started = time.time()
+        self.seen_prefixes = set()  # 模拟供应商前缀缓存：同一模型再次出现的 system 前缀按已缓存计
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, v = line.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+                    await self.chat(json.loads(body or b"{}"), writer)
+                elif method == "HEAD":
+                    writer.write(b"HTTP/1.1 200 OK\r\ncontent-length: 0\r\n\r\n")
+                    await writer.drain()
+                elif method == "GET" and path.rstrip("/").endswith("/stats"):
+                    elapsed = time.time() - self.started
+                    await self.respond(writer, 200, {**self.stats, "rps": round(self.stats["requests"] / elapsed, 1)})
+                else:
+                    await self.respond(writer, 404, {"error": {"message": f"no route {path}"}})
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, extra_headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {'OK' if status == 200 else 'ERR'}",
+                "content-type: application/json", f"content-length: {len(data)}"]
+        head += [f"{k}: {v}" for k, v in (extra_headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+    async def chat(self, req, writer):
+        cfg = self.cfg
+        self.stats["requests"] += 1
+        roll = random.random()
+        if roll < cfg.p429:
+            self.stats["429"] += 1
+            return await self.respond(writer, 429, {"error": {"message": "mock rate limit", "code": 429}},
+                                      {"retry-after-ms": str(cfg.retry_after_ms)})
+        if roll < cfg.p429 + cfg.p5xx:
+            self.stats["5xx"] += 1
+            await asyncio.sleep(self.latency() / 1000 / 2)
+            return await self.respond(writer, 503, {"error": {"message": "mock upstream error", "code": 503}})
+
+        messages = req.get("messages", [])
+        system = next((_text(m["content"]) for m in messages if m.get("role") == "system"), "")
+        user = next((_text(m["content"]) for m in reversed(messages) if m.get("role") == "user"), "")
+        n = int(req.get("n") or 1)
+        if req.get("response_format") and req.get("model") in cfg.reject_structured:
+            self.stats["400"] += 1
+            return await self.respond(writer, 400, {"error": {
+                "message": "response_format json_schema is not supported by this model", "code": 400}})
+        answer = structured_answer if req.get("response_format") else canned_answer
+        contents = [answer(system, user, cfg) for _ in range(n)]
+        prompt_tokens = _count_tokens("".join(_text(m.get("content")) for m in messages))
+        completion_tokens = [cfg.completion_tokens or _count_tokens(c) for c in contents]
+        # 与真实供应商一样，只有足够长的重复前缀 (system) 才会命中前缀缓存
+        prefix, prefix_tokens = (req.get("model"), system), _count_tokens(system)
+        cached = prefix_tokens if prefix_tokens >= cfg.cache_min_tokens and prefix in self.seen_prefixes else 0
+        self.seen_prefixes.add(prefix)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": sum(completion_tokens),
+                 "total_tokens": prompt_tokens + sum(completion_tokens),
+                 "prompt_tokens_details": {"cached_tokens": cached}}
+        base = {"id": f"mock-{self.stats['requests']}", "created": int(time.time()), "model": req.get("model", "mock")}
+
+        ttft_s = self.latency() / 1000
+        if req.get("stream"):
+            return await self.stream(writer, req, base, contents[0], usage, ttft_s)
+
+        await asyncio.sleep(ttft_s + max(completion_tokens) * cfg.tpot_ms / 1000)
+        self.stats["ok"] += 1
+        await self.respond(writer, 200, {
+            **base, "object": "chat.completion",
+            "choices": [{"index": i, "message": {"role": "assistant", "content": c}, "finish_reason": "stop",
+                         "logprobs": fake_logprobs(c) if req.get("logprobs") else None}
+                        for i, c in enumerate(contents)],
+            "usage": usage
+        })
+
+    async def stream(self, writer, req, base, content, usage, ttft_s):
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ntransfer-encoding: chunked\r\n\r\n")
+
+        async def send(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+
+        await asyncio.sleep(ttft_s)
+        pieces = [p + " " for p in content.split(" ")]
+        for i, piece in enumerate(pieces):
+            delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+            await send(json.dumps({**base, "object": "chat.completion.chunk",
+                                   "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+            if self.cfg.tpot_ms:
+                await asyncio.sleep(self.cfg.tpot_ms / 1000)
+        await send(json.dumps({**base, "object": "chat.completion.chunk",
+                               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (req.get("stream_options") or {}).get("include_usage"):
+            await send(json.dumps({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}))
+        await send("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        self.stats["ok"] += 1
+
+
+async def serve(cfg):
+    server = MockServer(cfg)
+    srv = await asyncio.start_server(server.handle, cfg.host, cfg.port, backlog=4096)
+    print(f"🧪 Mock OpenAI server on http://{cfg.host}:{cfg.port}/v1 | latency={cfg.latency} | "
+          f"p429={cfg.p429} | p5xx={cfg.p5xx}")
+    async with srv:
+        await srv.serve_forever()
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="OpenAI 兼容的本地假服务")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency", default="lognormal:300:0.5", help="首 token 延迟分布 (毫秒)")
+    p.add_argument("--tpot-ms", type=float, default=0.0, help="每个输出 token 的额外耗时")
+    p.add_argument("--completion-tokens", type=int, default=0, help="固定 completion_tokens，0 为按文本估算")
+    p.add_argument("--p429", type=float, default=0.0)
+    p.add_argument("--p5xx", type=float, default=0.0)
+    p.add_argument("--retry-after-ms", type=int, default=200)
+    p.add_argument("--p-garbage", type=float, default=0.0, help="返回无法解析文本的概率")
+    p.add_argument("--disagree", type=float, default=0.1, help="S1 采样答案偏离的概率")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--reject-structured", type=lambda s: set(s.split(",")), default=set(),
+                   help="逗号分隔的模型 id：带 response_format 的请求返回 400")
+    p.add_argument("--cache-min-tokens", type=int, default=1024,
+                   help="模拟前缀缓存的最短前缀 token 数 (OpenAI 为 1024)，0 为任何重复前缀都命中")
+    return p
+
+
+def main():
+    cfg = build_parser().parse_args()
+    if cfg.seed is not None:
+        random.seed(cfg.seed)
+    try:
+        asyncio.run(serve(cfg))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import contextvars
+import time
+
+
+NET_FIELDS = ["net_queue_ms", "net_connect_ms", "net_tls_ms", "net_wait_ms", "net_transfer_ms"]
+
+_current = contextvars.ContextVar("net_timings", default=None)
+
+
+# --- 单请求的网络分段耗时 ---
+def start_timing():
+    """在发请求前调用：之后同一协程里经过 AIMDTransport 的请求把分段耗时写进返回的 dict"""
+    timings = {}
+    _current.set(timings)
+    return timings
+
+
+def current_timings():
+    return _current.get()
+
+
+def make_trace(timings):
+    """
+    httpcore trace 回调，把事件折算成毫秒：
+    connect = TCP 建连，tls = TLS 握手 (复用连接时两者为 0)，
+    wait = 请求发出到收到响应头 (服务端排队 + 首包)，transfer = 读响应体 (流式时含生成时间)
+    """
+    started = {}
+    timings.setdefault("connect_ms", 0)
+    timings.setdefault("tls_ms", 0)
+
+    async def trace(event_name, info):
+        name = event_name.split(".", 1)[1] if event_name.startswith(("http11.", "http2.")) else event_name
+        stage, _, phase = name.rpartition(".")
+        if phase == "started":
+            started[stage] = time.perf_counter()
+        elif phase in ("complete", "failed") and stage in started:  # 流式提前断开时 body 阶段以 failed 结束
+            elapsed = int((time.perf_counter() - started[stage]) * 1000)
+            if stage == "connection.connect_tcp":
+                timings["connect_ms"] = elapsed
+            elif stage == "connection.start_tls":
+                timings["tls_ms"] = elapsed
+            elif stage == "receive_response_body":
+                timings["transfer_ms"] = elapsed
+        if name == "send_request_headers.started":
+            started["wait"] = time.perf_counter()
+        elif name == "receive_response_headers.complete" and "wait" in started:
+            timings["wait_ms"] = int((time.perf_counter() - started["wait"]) * 1000)
+
+    return trace
+
+
+def net_columns(timings):
+    """结果行里的网络分段列；没有记录 (缓存回放的旧数据 / 批处理) 时留空"""
+    timings = timings or {}
+    return {f: timings.get(f[len("net_"):], "") for f in NET_FIELDS}
@@ -0,0 +1,127 @@
+import asyncio
+import importlib.util
+import os
+import time
+from types import SimpleNamespace
+
+import httpx
+from openai import AsyncOpenAI, BadRequestError
+
+
+DEFAULT_PROVIDER = "openrouter"
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None  # httpx 的 HTTP/2 需要可选依赖 h2
+CACHE_CONTROL = {"type": "ephemeral"}  # 显式前缀缓存断点 (OpenRouter 透传给 Anthropic / Gemini 等需要标注的模型)
+
+
+# --- 供应商侧前缀缓存 ---
+def with_cache_control(messages):
+    """把字符串形式的 system 消息改写为带 cache_control 断点的 content parts，断点之前的固定前缀可被供应商缓存"""
+    return [{**m, "content": [{"type": "text", "text": m["content"], "cache_control": CACHE_CONTROL}]}
+            if m.get("role") == "system" and isinstance(m.get("content"), str) else m
+            for m in messages]
+
+
+def rejects_structured_output(e):
+    """供应商以 400 拒绝 response_format (模型不支持 JSON schema / 结构化输出)"""
+    message = str(e).lower()
+    return isinstance(e, BadRequestError) and any(w in message for w in ("response_format", "json_schema", "structured"))
+
+
+def cached_prompt_tokens(usage):
+    """usage.prompt_tokens_details.cached_tokens (SDK 对象或批处理结果里的 dict)；供应商不报告时为 0"""
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return cached or 0
+
+
+# --- 按 provider 分池的客户端注册表 ---
+class ProviderRegistry:
+    """
+    models.yaml 的 providers 段为每个供应商配置 base_url / api_key (或 api_key_env) 与连接池参数
+    (max_connections / max_keepalive / keepalive_expiry_s / http2 / warmup_connections)，
+    每个供应商一个 AsyncOpenAI 客户端和独立连接池；装了 h2 时 https 供应商默认走 HTTP/2 多路复用。
+    对外暴露与 AsyncOpenAI 相同的 chat.completions.create，按请求的 model 路由到其 provider；
+    未知模型走 DEFAULT_PROVIDER。环境变量 LLM_BASE_URL 会覆盖所有供应商 (本地压测用)。
+    模型配置 cache_control: true 时，其请求的 system 消息带上显式前缀缓存断点。
+    模型配置 structured_output: false 或运行中被供应商以 400 拒绝过 response_format 时，
+    去掉 response_format 改发普通请求，由正文解析兜底。
+    """
+
+    def __init__(self, providers, all_models, limiters, api_key, base_url):
+        override = os.environ.get("LLM_BASE_URL")
+        self.model_provider = {info["id"]: info.get("provider", DEFAULT_PROVIDER) for info in all_models.values()}
+        self.cache_control_models = {info["id"] for info in all_models.values() if info.get("cache_control")}
+        self.unstructured_models = {info["id"] for info in all_models.values()
+                                    if info.get("structured_output") is False}
+        names = set(self.model_provider.values()) | {DEFAULT_PROVIDER}
+        self.clients = {}
+        self.base_urls = {}
+        self.http_clients = {}
+        self.warmup_connections = {}
+        for name in sorted(names):
+            cfg = providers.get(name) or {}
+            url = override or cfg.get("base_url") or base_url
+            key = cfg.get("api_key") or os.environ.get(cfg.get("api_key_env") or "", "") or api_key
+            limits = httpx.Limits(max_connections=int(cfg.get("max_connections", 1000)),
+                                  max_keepalive_connections=int(cfg.get("max_keepalive", 100)),
+                                  keepalive_expiry=float(cfg.get("keepalive_expiry_s", 5.0)))
+            http2 = bool(cfg.get("http2", True)) and HTTP2_AVAILABLE and url.startswith("https")
+            http_client = limiters.http_client(transport=httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+            self.clients[name] = AsyncOpenAI(base_url=url, api_key=key, max_retries=0,  # 重试统一交给 Retrier
+                                             http_client=http_client)
+            self.base_urls[name] = url
+            self.http_clients[name] = http_client
+            self.warmup_connections[name] = int(cfg.get("warmup_connections", 8))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def for_model(self, model_id):
+        return self.clients[self.model_provider.get(model_id, DEFAULT_PROVIDER)]
+
+    async def _create(self, **kwargs):
+        model = kwargs.get("model")
+        if model in self.cache_control_models:
+            kwargs["messages"] = with_cache_control(kwargs["messages"])
+        if model in self.unstructured_models:
+            kwargs.pop("response_format", None)
+        try:
+            return await self.for_model(model).chat.completions.create(**kwargs)
+        except BadRequestError as e:
+            if "response_format" not in kwargs or not rejects_structured_output(e):
+                raise
+            if model not in self.unstructured_models:
+                self.unstructured_models.add(model)
+                print(f"⚠️ {model} 不支持结构化输出，改用正文解析")
+            kwargs.pop("response_format")
+            return await self.for_model(model).chat.completions.create(**kwargs)
+
+    async def warmup(self):
+        """启动时对每个供应商并发发若干 HEAD 请求，提前完成 TCP / TLS 握手，连接留在 keep-alive 池里"""
+        async def ping(http_client, url):
+            try:
+                await http_client.head(url, timeout=10)
+            except httpx.HTTPError:
+                pass
+
+        for name, http_client in self.http_clients.items():
+            n = self.warmup_connections[name]
+            if not n or not any(p == name for p in self.model_provider.values()):
+                continue
+            start = time.perf_counter()
+            await asyncio.gather(*(ping(http_client, self.base_urls[name]) for _ in range(n)))
+            print(f"🔥 {name}: 预热 {n} 个连接 ({(time.perf_counter() - start) * 1000:.0f}ms)")
+
+    def describe(self):
+        for name, url in self.base_urls.items():
+            models = [m for m, p in self.model_provider.items() if p == name]
+            if models or name == DEFAULT_PROVIDER:
+                print(f"🔌 {name} -> {url} | {len(models)} 个模型")
+
+
+def build_client(all_models, limiters, api_key, base_url, providers=None):
+    """入口脚本统一用的客户端；providers 缺省时读取 models.yaml 的 providers 段"""
+    if providers is None:
+        from Collector.engine import load_providers
+        providers = load_providers()
+    registry = ProviderRegistry(providers, all_models, limiters, api_key, base_url)
+    registry.describe()
+    return registry
@@ -0,0 +1,37 @@
+from Collector.cache import fetch
+from Collector.providers import cached_prompt_tokens
+from Collector.retry import call_with_retry
+
+
+REPAIR_MAX_TOKENS = 40  # 修复追问只要一行格式化的答案
+
+
+# --- 解析失败的定向追问 ---
+def repair_body(body, raw, prompt):
+    """
+    在原请求的对话后接上原回答与一句格式追问：前缀与原请求一致 (可命中供应商前缀缓存)，
+    只需很少的输出 token 就能拿回答案与置信度，不必重跑整段推理
+    """
+    return {
+        "model": body["model"],
+        "messages": body["messages"] + [{"role": "assistant", "content": raw}, {"role": "user", "content": prompt}],
+        "max_tokens": REPAIR_MAX_TOKENS,
+        "temperature": 0
+    }
+
+
+async def reask(client, body, cache=None, retrier=None, system="repair"):
+    """发送修复追问 (可命中缓存、失败重试)。返回 (content, (prompt, completion, cached_prompt) tokens, 是否命中缓存)"""
+    async def request():
+        response = await call_with_retry(retrier, (body["model"], system),
+                                         lambda: client.chat.completions.create(**body, timeout=20))
+        return {
+            "contents": [response.choices[0].message.content or ""],
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "cached_tokens": cached_prompt_tokens(response.usage)
+        }
+
+    payload, cached = await fetch(cache, ("repair", body["model"], body["messages"], body["max_tokens"]), request)
+    tokens = (payload["prompt_tokens"], payload["completion_tokens"], payload["cached_tokens"])
+    return payload["contents"][0], tokens, cached
@@ -0,0 +1,127 @@
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+import openai
+
+
+# --- 1. 可重试错误判定 ---
+def is_retryable(e):
+    """超时 / 连接错误 / 429 / 5xx 可重试；4xx 参数错误、解析错误等直接放弃"""
+    if isinstance(e, (openai.APIConnectionError, openai.RateLimitError, asyncio.TimeoutError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code >= 500 or e.status_code in (408, 409, 429)
+    return False
+
+
+def _retry_after_s(e):
+    response = getattr(e, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        return float(response.headers.get("retry-after", 0))
+    except ValueError:
+        return 0.0
+
+
+# --- 2. 重试 + 对冲请求 ---
+class Retrier:
+    """
+    - 重试：full-jitter 指数退避 uniform(0, min(cap, base * 2^n))，服务端给了 retry-after 时取两者较大值
+    - 重试预算：重试与对冲的额外请求总数不超过 budget_ratio × 原始请求数 + min_budget，
+      避免故障期间重试把流量放大成风暴
+    - 对冲 (hedge=True)：请求超过该 (模型, 类型) 近期 p95 仍未返回时再发一份，先成功者胜出，另一份取消
+    """
+
+    def __init__(self, max_attempts=4, base_s=0.5, cap_s=20.0, budget_ratio=0.2, min_budget=10,
+                 hedge=False, hedge_quantile=0.95, min_samples=20):
+        self.max_attempts = max_attempts
+        self.base_s = base_s
+        self.cap_s = cap_s
+        self.budget_ratio = budget_ratio
+        self.min_budget = min_budget
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.latencies = defaultdict(lambda: deque(maxlen=200))
+        self.stats = Counter()
+
+    def _take_budget(self):
+        if self.stats["extra"] < self.budget_ratio * self.stats["calls"] + self.min_budget:
+            self.stats["extra"] += 1
+            return True
+        self.stats["budget_exhausted"] += 1
+        return False
+
+    def hedge_delay_s(self, key):
+        samples = self.latencies[key]
+        if not self.hedge or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return max(0.05, ordered[int(self.hedge_quantile * (len(ordered) - 1))])
+
+    async def _first_success(self, primary, backup):
+        pending = {primary, backup}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    if fut.exception() is None:
+                        if fut is backup:
+                            self.stats["hedge_wins"] += 1
+                        return fut.result()
+                    error = fut.exception()
+            raise error
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+    async def _attempt(self, key, request):
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(request())
+        delay = self.hedge_delay_s(key)
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and self._take_budget():
+                    self.stats["hedges"] += 1
+                    result = await self._first_success(primary, asyncio.ensure_future(request()))
+                    self.latencies[key].append(time.perf_counter() - start)
+                    return result
+            result = await primary
+        except BaseException:
+            primary.cancel()
+            raise
+        self.latencies[key].append(time.perf_counter() - start)
+        return result
+
+    async def call(self, key, request):
+        """key: (model_id, 请求类型)，用于分开统计延迟分位数；request: 无参协程工厂"""
+        self.stats["calls"] += 1
+        for attempt in range(self.max_attempts):
+            try:
+                return await self._attempt(key, request)
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_attempts - 1 or not self._take_budget():
+                    self.stats["giveups"] += 1
+                    raise
+                self.stats["retries"] += 1
+                backoff = random.uniform(0, min(self.cap_s, self.base_s * 2 ** attempt))
+                await asyncio.sleep(max(backoff, _retry_after_s(e)))
+
+
+async def call_with_retry(retrier, key, request):
+    if retrier is None:
+        return await request()
+    return await retrier.call(key, request)
+
+
+def print_retry_stats(retrier):
+    s = retrier.stats
+    print(f"\n🔁 重试: calls={s['calls']} | retries={s['retries']} | giveups={s['giveups']} | "
+          f"hedges={s['hedges']} (wins={s['hedge_wins']}) | budget_exhausted={s['budget_exhausted']}")
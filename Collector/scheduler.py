@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import Counter, defaultdict, deque
+from Collector.limiter import aimd_bounds
+
+
+DEFAULT_CONCURRENCY = 32
+
+
+# --- 全局作业调度器 ---
+class Scheduler:
+    """
+    所有 (数据集, 模型, 任务, 系统) 作业进入同一个调度器，按模型分道排队。
+    只要某模型及其供应商还有空闲槽位就立即派发，慢模型不会让其他模型空等。
+    ledger (CostLedger) 给出时按预算派发：全局预算用尽即停止派发；
+    模型预算用尽时 budget_mode="stop" 丢弃该模型剩余作业，"deprioritise" 只在其他模型都排空后再派发。
+    未派发的作业没有写入结果，下次运行自动续跑。
+    模型槽位按 AIMD 上限 (aimd.max，缺省为初始并发的 4 倍) 设置，实际在途请求由传输层的 AIMD 控制器收放。
+    """
+
+    def __init__(self, all_models, providers=None, default_limit=DEFAULT_CONCURRENCY,
+                 ledger=None, budget_mode="stop"):
+        providers = providers or {}
+        self.model_limit = {k: int(aimd_bounds(info, default_limit)[2]) for k, info in all_models.items()}
+        self.model_provider = {k: info.get("provider", "default") for k, info in all_models.items()}
+        self.provider_limit = {}
+        for model_key, provider in self.model_provider.items():
+            cfg = providers.get(provider) or {}
+            # 未配置上限的供应商：容量为其下所有模型上限之和
+            self.provider_limit[provider] = int(cfg.get("max_concurrency", 0)) or \
+                self.provider_limit.get(provider, 0) + self.model_limit[model_key]
+
+        self.lanes = {k: deque() for k in all_models}
+        self.inflight_model = Counter()
+        self.inflight_provider = Counter()
+        self.busy_s = defaultdict(float)  # 每个供应商累计占用的槽位时间
+        self.done = Counter()
+        self.ledger = ledger
+        self.budget_mode = budget_mode
+        self.skipped = Counter()
+
+    def submit(self, job):
+        self.lanes[job["model_key"]].append(job)
+
+    def pending(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def _has_slot(self, model_key):
+        provider = self.model_provider[model_key]
+        return (self.inflight_model[model_key] < self.model_limit[model_key]
+                and self.inflight_provider[provider] < self.provider_limit[provider])
+
+    def _drop(self, model_keys, reason):
+        for model_key in model_keys:
+            if self.lanes[model_key]:
+                print(f"💸 {reason}: 跳过 {model_key} 剩余 {len(self.lanes[model_key])} 个作业")
+                self.skipped[model_key] += len(self.lanes[model_key])
+                self.lanes[model_key].clear()
+
+    def _over_budget_lanes(self):
+        """返回预算已用尽、但还有排队作业的模型；按 budget_mode 丢弃或留待降级派发"""
+        if not self.ledger:
+            return set()
+        if self.ledger.over_global_budget():
+            self._drop(self.lanes, "全局预算用尽")
+            return set()
+        exhausted = {m for m, lane in self.lanes.items() if lane and self.ledger.over_model_budget(m)}
+        if exhausted and self.budget_mode == "stop":
+            self._drop(exhausted, "模型预算用尽")
+            return set()
+        return exhausted
+
+    async def _execute(self, execute, job):
+        model_key = job["model_key"]
+        provider = self.model_provider[model_key]
+        start = time.perf_counter()
+        try:
+            await execute(job)
+        finally:
+            self.busy_s[provider] += time.perf_counter() - start
+            self.inflight_model[model_key] -= 1
+            self.inflight_provider[provider] -= 1
+            self.done[model_key] += 1
+
+    async def run(self, execute):
+        """execute: async (job) -> None。返回调度统计"""
+        start = time.perf_counter()
+        running = set()
+        order = list(self.lanes)
+        turn = 0
+
+        while running or self.pending():
+            exhausted = self._over_budget_lanes()
+            others_waiting = any(lane for m, lane in self.lanes.items() if m not in exhausted)
+            # 轮转起点，避免供应商槽位总被排在前面的模型占满
+            for model_key in order[turn:] + order[:turn]:
+                if model_key in exhausted and others_waiting:
+                    continue
+                lane = self.lanes[model_key]
+                while lane and self._has_slot(model_key):
+                    job = lane.popleft()
+                    self.inflight_model[model_key] += 1
+                    self.inflight_provider[self.model_provider[model_key]] += 1
+                    running.add(asyncio.ensure_future(self._execute(execute, job)))
+            turn = (turn + 1) % max(len(order), 1)
+
+            if not running:
+                break
+            finished, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for fut in finished:
+                fut.result()
+
+        return self.report(time.perf_counter() - start)
+
+    def report(self, makespan_s):
+        providers = {}
+        for provider, limit in self.provider_limit.items():
+            busy = self.busy_s.get(provider, 0.0)
+            providers[provider] = {
+                "limit": limit,
+                "busy_s": round(busy, 2),
+                "utilisation": round(busy / (limit * makespan_s), 4) if makespan_s > 0 else 0.0
+            }
+        total_jobs = sum(self.done.values())
+        return {
+            "makespan_s": round(makespan_s, 2),
+            "jobs": total_jobs,
+            "throughput_per_s": round(total_jobs / makespan_s, 2) if makespan_s > 0 else 0.0,
+            "providers": providers,
+            "per_model": dict(self.done),
+            "skipped": dict(self.skipped)
+        }
+
+
+def print_report(stats):
+    print(f"\n📊 Makespan: {stats['makespan_s']}s | Jobs: {stats['jobs']} | "
+          f"Throughput: {stats['throughput_per_s']}/s")
+    for provider, p in stats["providers"].items():
+        print(f"   {provider}: limit={p['limit']} | busy={p['busy_s']}s | utilisation={p['utilisation']:.1%}")
+    if stats.get("skipped"):
+        print(f"   💸 预算跳过作业: {sum(stats['skipped'].values())}")
+    if stats.get("dedup"):
+        print(f"   🧬 去重复用结果: {stats['dedup']['rows']} 行 | 节省请求 {stats['dedup']['requests']} 次")
+    if stats.get("parse"):
+        print("   🧩 解析失败率 (PARSE_ERR / 答案数):")
+        for (model_key, system), c in stats["parse"].items():
+            print(f"      {model_key} {system}: {c['errors']}/{c['answers']} ({c['errors'] / c['answers']:.1%})")
@@ -0,0 +1,106 @@
+import csv
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from Collector.index import CompletionIndex
+
+
+_TICK = object()
+
+
+# --- 单写线程的结果落盘 ---
+class ResultSink:
+    """
+    所有结果行经队列交给一个写线程：每个输出文件只打开一次，
+    行先攒批，满 batch_size 行或距上次刷盘超过 flush_interval_s 秒时统一写出；
+    fsync=True 时每次刷盘后同步到磁盘，随后原子更新该文件的完成索引。
+    采集协程只做入队，不碰文件；写线程出错 (磁盘满、坏行等) 后，下一次入队立即抛错，不再静默丢行。
+    """
+
+    def __init__(self, batch_size=64, flush_interval_s=1.0, fsync=False):
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.fsync = fsync
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="result-sink", daemon=True)
+        self.files = {}                  # file_path -> (handle, DictWriter)
+        self.indexes = {}                # file_path -> CompletionIndex
+        self.buffers = defaultdict(list)  # file_path -> 待写行
+        self.pending = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.error = None
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def write(self, file_path, fieldnames, row):
+        if self.error:
+            raise RuntimeError(f"结果写线程已退出: {type(self.error).__name__}: {self.error}") from self.error
+        self.queue.put((file_path, fieldnames, row))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+    def _writer(self, file_path, fieldnames):
+        if file_path not in self.files:
+            is_new = not file_path.exists() or file_path.stat().st_size == 0
+            f = open(file_path, "a", newline="", encoding="utf-8-sig")
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            if is_new: writer.writeheader()
+            self.files[file_path] = (f, writer)
+            self.indexes[file_path] = CompletionIndex.load(file_path)
+        return self.files[file_path]
+
+    def _flush(self):
+        for file_path, rows in self.buffers.items():
+            if not rows: continue
+            f, writer = self.files[file_path]
+            writer.writerows(rows)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            index = self.indexes[file_path]
+            index.add(int(r["id"]) for r in rows)
+            index.save(os.fstat(f.fileno()).st_size)
+            self.rows_written += len(rows)
+        self.buffers.clear()
+        self.pending = 0
+        self.flushes += 1
+
+    def _run(self):
+        last_flush = time.monotonic()
+        try:
+            while True:
+                wait = max(0.0, self.flush_interval_s - (time.monotonic() - last_flush))
+                try:
+                    item = self.queue.get(timeout=wait)
+                except queue.Empty:
+                    item = _TICK
+                if item is None:
+                    break
+
+                if item is not _TICK:
+                    file_path, fieldnames, row = item
+                    self._writer(file_path, fieldnames)
+                    self.buffers[file_path].append(row)
+                    self.pending += 1
+
+                if self.pending and (self.pending >= self.batch_size
+                                     or time.monotonic() - last_flush >= self.flush_interval_s):
+                    self._flush()
+                    last_flush = time.monotonic()
+                elif not self.pending:
+                    last_flush = time.monotonic()
+            self._flush()
+        except Exception as e:
+            self.error = e
+        finally:
+            for f, _ in self.files.values():
+                f.close()
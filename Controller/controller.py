@@ -1,13 +1,164 @@
 # controller.py
-from S2.S2 import run_s2
-from S1.S1 import run_s1
+import asyncio
+import time
+from collections import Counter
+from openai import AsyncOpenAI
+from RUNS1 import run_s1_task, normalize_answer
+from RUNS2 import run_s2_task, estimate_tokens, S2_INSTRUCTION
+from Collector.ledger import token_count
+
+# 路由阈值：置信度 (0-1)、困惑度、自洽性 (与多数答案一致的采样占比)
+CASCADE_THRESHOLDS = {"conf": 0.8, "ppl": 5.0, "sc": 0.8}
+
 
 def should_call_s2(s1_out, thresholds):
     """
     决策函数：根据 S1 输出判断是否需要调用 S2
+    缺失的信号 (None，如供应商未返回 logprobs 时的困惑度) 不参与判断
     """
     return not (
         s1_out["confidence"] > thresholds.get("conf", 0.8)
-        and s1_out["perplexity"] < thresholds.get("ppl", 5.0)
+        and (s1_out["perplexity"] is None or s1_out["perplexity"] < thresholds.get("ppl", 5.0))
         and s1_out["self_consistency"] > thresholds.get("sc", 0.8)
     )
+
+
+# --- 1. S1 路由信号 ---
+def s1_signals(s1_row):
+    """从 S1 结果行计算路由信号：置信度归一到 0-1，自洽性为与多数答案一致的采样占比"""
+    answers = [normalize_answer(a) for a in s1_row.get("_sample_answers", []) if a != "PARSE_ERR"]
+    majority = Counter(answers).most_common(1)[0][1] if answers else 0
+    perplexity = s1_row.get("s1_perplexity")
+    return {
+        "confidence": int(s1_row["s1_confidence"]) / 100,
+        "self_consistency": majority / max(s1_row.get("samples_count") or 1, 1),
+        "perplexity": float(perplexity) if perplexity not in (None, "") else None
+    }
+
+
+# --- 2. 级联任务：S1 先答，不够确定时再升级到 S2 ---
+def _merged_row(task_id, question, mode, s1, s2, signals, escalate, start_time, extra_billed=(0, 0, 0)):
+    # route —— s1: S1 直出 | s2: 升级到 S2 | s1_fallback: 需要升级但 S2 失败，沿用 S1 答案
+    route = "s2" if s2 else ("s1_fallback" if escalate else "s1")
+    final, system = (s2, "s2") if s2 else (s1, "s1")
+    billed = [s1["_billed"], extra_billed] + ([s2["_billed"]] if s2 else [])
+    return {
+        "id": task_id,
+        "task": question,
+        "cascade_mode": mode,
+        "route": route,
+        "final_answer": final[f"{system}_answer"],
+        "final_confidence": final[f"{system}_confidence"],
+        "s1_answer": s1["s1_answer"],
+        "s1_confidence": s1["s1_confidence"],
+        "self_consistency": round(signals["self_consistency"], 4),
+        "perplexity": "" if signals["perplexity"] is None else signals["perplexity"],
+        "s2_answer": s2["s2_answer"] if s2 else "",
+        "s2_confidence": s2["s2_confidence"] if s2 else "",
+        "latency_ms": int((time.perf_counter() - start_time) * 1000),
+        "s1_latency_ms": s1["latency_ms"],
+        "s2_latency_ms": s2["latency_ms"] if s2 else "",
+        "prompt_tokens": sum(token_count(r["prompt_tokens"]) for r in (s1, s2) if r),
+        "completion_tokens": sum(token_count(r["completion_tokens"]) for r in (s1, s2) if r),
+        "s1_raw_output": s1["s1_raw_output"],
+        "s2_raw_output": s2["s2_raw_output"] if s2 else "",
+        "cached_prompt_tokens": sum(token_count(r["cached_prompt_tokens"]) for r in (s1, s2) if r),
+        "s1_repaired": s1["s1_repaired"],
+        "s2_repaired": s2["s2_repaired"] if s2 else "",
+        "tokens_estimated": s2["tokens_estimated"] if s2 else 0,
+        "_billed": tuple(sum(token_count(b[i]) for b in billed if i < len(b)) for i in range(3)),
+        "_calls": s1["_calls"] + (1 if s2 else 0)
+    }
+
+
+async def run_cascade_task(task_id: int, question: str, model_id: str, client: AsyncOpenAI,
+                           thresholds=None, cache=None, retrier=None, routes: Counter = None):
+    """返回合并行 (含路由决策)；routes 用于统计本次运行的升级率"""
+    thresholds = thresholds or CASCADE_THRESHOLDS
+    start_time = time.perf_counter()
+    s1 = await run_s1_task(task_id, question, model_id, client, cache=cache, retrier=retrier)
+    if not s1:
+        return None
+
+    signals = s1_signals(s1)
+    escalate = should_call_s2(signals, thresholds)
+    s2 = await run_s2_task(task_id, question, model_id, client, cache=cache, retrier=retrier) if escalate else None
+    row = _merged_row(task_id, question, "sequential", s1, s2, signals, escalate, start_time)
+    if routes is not None:
+        routes[row["route"]] += 1
+    return row
+
+
+# --- 3. 推测式级联：S1 与 S2 同时发出，S1 足够确定时取消 S2 ---
+async def run_speculative_task(task_id: int, question: str, model_id: str, client: AsyncOpenAI,
+                               thresholds=None, cache=None, retrier=None, routes: Counter = None):
+    """
+    升级的任务端到端延迟约为 max(S1, S2) 而不是 S1 + S2；代价是 S1 直出时被取消的 S2 已消耗的 token。
+    取消时拿不到 usage：已受理请求的 prompt 按字符数估算，completion 按已收到的内容块数计。
+    S2 一律走流式 (不受 S2_STREAM 影响)：取消即断开连接，且只有流式请求能记录已受理请求数与已收到的内容块数。
+    """
+    thresholds = thresholds or CASCADE_THRESHOLDS
+    start_time = time.perf_counter()
+    progress = Counter()
+    s2_future = asyncio.ensure_future(run_s2_task(task_id, question, model_id, client, cache=cache,
+                                                  stream=True, retrier=retrier, progress=progress))
+    try:
+        s1 = await run_s1_task(task_id, question, model_id, client, cache=cache, retrier=retrier)
+    except BaseException:
+        s2_future.cancel()
+        raise
+
+    signals = s1_signals(s1) if s1 else None
+    escalate = bool(s1) and should_call_s2(signals, thresholds)
+    if not escalate:
+        s2_future.cancel()
+        await asyncio.gather(s2_future, return_exceptions=True)  # 等流式连接真正关闭
+        if not s1:
+            return None
+        finished = s2_future.done() and not s2_future.cancelled() and s2_future.result()
+        if finished:
+            wasted = tuple(token_count(t) for t in finished["_billed"])
+        else:
+            prompt = estimate_tokens(S2_INSTRUCTION + f"Question: {question}")
+            wasted = (prompt * progress["requests"], progress["chunks"], 0)
+        row = _merged_row(task_id, question, "speculative", s1, None, signals, False, start_time, wasted)
+        row.update({"s2_cancelled": int(not finished), "wasted_prompt_tokens": wasted[0],
+                    "wasted_completion_tokens": wasted[1], "latency_saved_ms": 0})
+    else:
+        s2 = await s2_future
+        row = _merged_row(task_id, question, "speculative", s1, s2, signals, True, start_time)
+        # 顺序级联下的延迟 (S1 + S2) 与实际端到端延迟之差；任一路命中缓存时延迟是回放的历史值，不计节省
+        if s2 and (s1.get("_cached") or s2.get("_cached")):
+            saved = ""
+        else:
+            saved = max(s1["latency_ms"] + s2["latency_ms"] - row["latency_ms"], 0) if s2 else 0
+        row.update({"s2_cancelled": 0, "wasted_prompt_tokens": 0, "wasted_completion_tokens": 0,
+                    "latency_saved_ms": saved})
+
+    if routes is not None:
+        routes[row["route"]] += 1
+        routes["s2_cancelled"] += row["s2_cancelled"]
+        routes["wasted_tokens"] += row["wasted_prompt_tokens"] + row["wasted_completion_tokens"]
+        routes["latency_saved_ms"] += row["latency_saved_ms"] or 0
+    return row
+
+
+FIELDNAMES = [
+    "id", "task", "cascade_mode", "route", "final_answer", "final_confidence",
+    "s1_answer", "s1_confidence", "self_consistency", "perplexity",
+    "s2_answer", "s2_confidence", "latency_ms", "s1_latency_ms", "s2_latency_ms",
+    "prompt_tokens", "completion_tokens", "s1_raw_output", "s2_raw_output",
+    "s2_cancelled", "wasted_prompt_tokens", "wasted_completion_tokens", "latency_saved_ms",
+    "cached_prompt_tokens", "s1_repaired", "s2_repaired", "tokens_estimated"
+]
+
+
+def print_routes(routes):
+    total = routes["s1"] + routes["s2"] + routes["s1_fallback"]
+    if not total: return
+    escalated = routes["s2"] + routes["s1_fallback"]
+    print(f"\n🔀 级联路由: S1 直出 {routes['s1']} | 升级 S2 {escalated} ({escalated / total:.1%}) | "
+          f"S2 失败回退 S1 {routes['s1_fallback']}")
+    if routes["s2_cancelled"] or routes["latency_saved_ms"]:
+        print(f"   ⚡ 推测执行: 取消 S2 {routes['s2_cancelled']} 次 | 浪费 {routes['wasted_tokens']} tokens | "
+              f"升级任务共节省 {routes['latency_saved_ms'] / 1000:.1f}s")
@@ -58,9 +58,15 @@ def main():
         # 排除简答题和补全类的辅助文件
         if "_si_" in csv_f.name.lower() or "_completed" in csv_f.name.lower():
             continue
+        # 只处理采集结果 (跳过 cost_ledger.csv 等辅助表)
+        if not csv_f.stem.endswith(("_s1", "_s2", "_cascade")):
+            continue
 
-        # 识别 S1 或 S2 答案列
-        ans_col = "s1_answer" if "_s1" in csv_f.name.lower() else "s2_answer"
+        # 识别 S1 / S2 / 级联答案列
+        if csv_f.stem.endswith("_cascade"):
+            ans_col = "final_answer"
+        else:
+            ans_col = "s1_answer" if "_s1" in csv_f.name.lower() else "s2_answer"
 
         rows = []
         try:
@@ -0,0 +1,127 @@
+"""
+对已采集结果做定向修复：S1 答案为 PARSE_ERR、S2 没有 Final Answer 行且尚未修复过的行，带上保存的原始回答追问一次格式化答案，
+修复后的答案 / 置信度原地写回 (追问的 token 计入该行用量，答案变化时清空 T_F 等待重新裁判)。
+只花一次低 max_tokens 的追问，不重跑整段推理。建议先跑 REPARSE.py，解析器能救回的行就不必再花钱。
+
+    python REPAIR.py
+"""
+import asyncio
+import csv
+from collections import Counter
+from pathlib import Path
+import RUNS1
+import RUNS2
+from REPARSE import result_files, s2_raw
+from Collector.cache import ResponseCache, print_cache_stats
+from Collector.repair import repair_body, reask
+from Collector.limiter import AIMDRegistry, print_limits
+from Collector.providers import build_client
+from Collector.retry import Retrier, print_retry_stats
+from Collector.ledger import CostLedger, print_ledger, token_count
+
+
+# --- 1. 找出需要修复的行 ---
+def needs_repair(row, system):
+    if token_count(row.get(f"{system}_repaired")):
+        return False  # 已修复过：原始输出不会变，再追问只会重复计费
+    if system == "s1":
+        return row.get("s1_answer") == "PARSE_ERR" and bool(row.get("s1_raw_output", "").strip())
+    raw = s2_raw(row)
+    return bool(raw.strip()) and RUNS2.s2_answer_missing(raw)
+
+
+async def repair_row(row, system, model_id, client, cache, retrier):
+    """返回 (是否修复成功, 本次实付 tokens)"""
+    if system == "s1":
+        ans, conf, tokens, cached = await RUNS1.repair_s1_sample(row["task"], model_id, row["s1_raw_output"],
+                                                                 client, cache, retrier)
+        ok = ans != "PARSE_ERR"
+    else:
+        raw = s2_raw(row)
+        body = repair_body(RUNS2.s2_body(f"Question: {row['task']}", model_id), raw, RUNS2.S2_REPAIR_PROMPT)
+        content, tokens, cached = await reask(client, body, cache, retrier, "s2_repair")
+        ok = not RUNS2.s2_answer_missing(content)
+        ans, conf = RUNS2.parse_s2_output(content) if ok else (None, None)
+
+    if not cached:  # 缓存回放的追问没有产生新用量
+        row["prompt_tokens"] = token_count(row.get("prompt_tokens")) + tokens[0]
+        row["completion_tokens"] = token_count(row.get("completion_tokens")) + tokens[1]
+    if ok:
+        if row.get("T_F") and row[f"{system}_answer"] != ans:
+            row["T_F"] = ""  # 答案变了，旧判定作废
+        row[f"{system}_answer"], row[f"{system}_confidence"] = ans, conf
+        row[f"{system}_repaired"] = token_count(row.get(f"{system}_repaired")) + 1
+    return ok, (0, 0, 0) if cached else tokens
+
+
+# --- 2. 逐文件修复并写回 ---
+async def repair_file(csv_f, system, model_key, model_id, client, cache, retrier, ledger, stats):
+    with open(csv_f, "r", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        rows = list(reader)
+
+    todo = [row for row in rows if needs_repair(row, system)]
+    if not todo:
+        return
+    print(f"🩹 {csv_f.name}: 修复 {len(todo)} 行")
+
+    async def one(row):
+        try:
+            ok, billed = await repair_row(row, system, model_id, client, cache, retrier)
+        except Exception as e:
+            print(f"⚠️ Repair failed ({model_id}): {type(e).__name__}: {e}")
+            stats["failed"] += 1
+            return
+        stats["repaired" if ok else "unrecovered"] += 1
+        ledger.record(model_key, csv_f.stem, f"{system}_repair", *billed)
+
+    await asyncio.gather(*(one(row) for row in todo))
+
+    column = f"{system}_repaired"
+    if column not in fieldnames: fieldnames.append(column)
+    tmp = csv_f.with_name(csv_f.name + ".tmp")
+    with open(tmp, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    tmp.replace(csv_f)
+
+
+async def main_async():
+    api_key, all_models, base_url = RUNS1.load_config()
+    if not api_key: return
+
+    limiters = AIMDRegistry(all_models)
+    client = build_client(all_models, limiters, api_key, base_url)
+    await client.warmup()
+    cache = ResponseCache() if RUNS1.USE_CACHE else None
+    retrier = Retrier(hedge=RUNS1.HEDGE)
+    ledger = CostLedger(all_models, "repair", budget_usd=RUNS1.BUDGET_USD, budget_tokens=RUNS1.BUDGET_TOKENS)
+    results_base = Path("Results")
+
+    stats = Counter()
+    for csv_f, system in result_files(results_base):
+        model_key = csv_f.relative_to(results_base).parts[0]
+        if system == "cascade" or model_key not in all_models:
+            continue
+        if ledger.over_global_budget():
+            print("💸 预算用尽，停止修复")
+            break
+        await repair_file(csv_f, system, model_key, all_models[model_key]["id"], client, cache, retrier, ledger, stats)
+
+    ledger.save()
+    print(f"\n🩹 修复完成: 成功 {stats['repaired']} | 追问后仍无法解析 {stats['unrecovered']} | 请求失败 {stats['failed']}")
+    print_limits(limiters)
+    print_retry_stats(retrier)
+    print_ledger(ledger)
+    if cache:
+        print_cache_stats(cache)
+
+
+def main():
+    asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    main()
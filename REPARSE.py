@@ -0,0 +1,149 @@
+"""
+离线重解析：解析器改进后，不必重新调用 API，直接用 Results 里保存的原始输出重算答案与置信度。
+
+    python REPARSE.py              # 重解析全部 *_s1 / *_s2 / *_cascade 结果并回写
+    python REPARSE.py --dry-run    # 只出差异报告，不改 CSV
+
+只重写答案或置信度有变化的行所在的文件；答案实质变化的行清空 T_F，留给裁判脚本重新判定。
+经修复追问拿回答案的行 (s1_repaired / s2_repaired > 0)、S2 没有 Final Answer 行且已有答案的行保持不动。
+差异明细写入 Results/reparse_diff.csv (文件、id、列、旧值、新值)。
+S1 只保存了主采样的原始输出，consistency_entropy 等多采样指标保持不变。
+"""
+import argparse
+import csv
+import time
+from collections import Counter
+from pathlib import Path
+from RUNS1 import parse_s1_output, normalize_answer
+from RUNS2 import parse_s2_output, s2_answer_missing
+from Collector.ledger import token_count
+
+DIFF_NAME = "reparse_diff.csv"  # 写在 --results 目录下
+DIFF_FIELDS = ["file", "id", "column", "old", "new"]
+
+
+# --- 1. 原始输出 -> (答案, 置信度) ---
+def s1_raw(row):
+    return row.get("s1_raw_output") or ""
+
+
+def s2_raw(row):
+    # s2_reasoning 写入时把换行替换成了两个空格，还原后 Final Answer 行的边界与采集时一致
+    return (row.get("s2_reasoning") or "").replace("  ", "\n") or row.get("s2_raw_output") or ""
+
+
+# 每种结果文件：(答案列, 置信度列, 原始输出, 解析器)
+PARSERS = {
+    "s1": [("s1_answer", "s1_confidence", s1_raw, parse_s1_output)],
+    "s2": [("s2_answer", "s2_confidence", s2_raw, parse_s2_output)],
+    "cascade": [("s1_answer", "s1_confidence", s1_raw, parse_s1_output),
+                ("s2_answer", "s2_confidence", s2_raw, parse_s2_output)]
+}
+
+
+def _core(ans):
+    """判定是否需要重裁用：只差括号 / 加粗等格式的答案视为同一答案"""
+    return normalize_answer(str(ans).replace("**", "").strip(" []"))
+
+
+def reparse_row(row, system, memo):
+    """原地更新 row，返回 [(列, 旧值, 新值), ...]；相同原始输出只解析一次"""
+    changes = []
+    for ans_col, conf_col, raw_of, parse in PARSERS[system]:
+        if not row.get(ans_col) and system == "cascade":
+            continue  # 级联中未升级到 S2 的行
+        if token_count(row.get(ans_col.replace("_answer", "_repaired"))):
+            continue  # 答案来自修复追问，原始输出仍是当初解析失败的文本，重解析只会把答案改回去
+        raw = raw_of(row)
+        if raw_of is s2_raw and s2_answer_missing(raw) and row.get(ans_col) not in ("", "PARSE_ERR"):
+            # 没有 Final Answer 行时解析器退回取最后一行：换行是从双空格还原的，会误拆缩进 / 连续空格，
+            # 最后一行与截断位置都可能变化而答案并无实质改变，已有答案的行不动
+            continue
+        key = (parse, raw)
+        if key not in memo:
+            memo[key] = tuple(str(v) for v in parse(raw))
+        for col, new in zip((ans_col, conf_col), memo[key]):
+            if row.get(col, "") != new:
+                changes.append((col, row.get(col, ""), new))
+                row[col] = new
+
+    if system == "cascade" and changes:
+        final = "s2" if row.get("route") == "s2" else "s1"
+        for col, src in (("final_answer", f"{final}_answer"), ("final_confidence", f"{final}_confidence")):
+            if row.get(col) != row[src]:
+                changes.append((col, row.get(col, ""), row[src]))
+                row[col] = row[src]
+    if row.get("T_F") and any(col.endswith("_answer") and _core(old) != _core(new) for col, old, new in changes):
+        changes.append(("T_F", row["T_F"], ""))
+        row["T_F"] = ""  # 答案实质变化，旧判定作废
+    return changes
+
+
+# --- 2. 逐文件重解析 ---
+def reparse_file(csv_f, system, memo, dry_run=False):
+    with open(csv_f, "r", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        rows = list(reader)
+
+    diffs = []
+    for row in rows:
+        diffs += [(row["id"], col, old, new) for col, old, new in reparse_row(row, system, memo)]
+    if diffs and not dry_run:
+        tmp = csv_f.with_name(csv_f.name + ".tmp")
+        with open(tmp, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        tmp.replace(csv_f)  # 完成索引按文件大小校验，下次续跑时自动重建
+    return diffs
+
+
+def result_files(results_base):
+    for csv_f in sorted(results_base.rglob("*.csv")):
+        system = csv_f.stem.rsplit("_", 1)[-1]
+        if system in PARSERS:
+            yield csv_f, system
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用已保存的原始输出离线重解析 S1 / S2 答案")
+    parser.add_argument("--results", default="Results")
+    parser.add_argument("--dry-run", action="store_true", help="只输出差异报告，不回写 CSV")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results_base = Path(args.results)
+    memo, all_diffs, stats = {}, [], Counter()
+    for csv_f, system in result_files(results_base):
+        diffs = reparse_file(csv_f, system, memo, args.dry_run)
+        stats["files"] += 1
+        if not diffs:
+            continue
+        rel = csv_f.relative_to(results_base).as_posix()
+        stats["changed_files"] += 1
+        stats["changed_rows"] += len({d[0] for d in diffs})
+        for task_id, col, old, new in diffs:
+            stats["fixed"] += col.endswith("_answer") and old == "PARSE_ERR"
+            stats["broken"] += col.endswith("_answer") and new == "PARSE_ERR"
+            all_diffs.append({"file": rel, "id": task_id, "column": col, "old": old, "new": new})
+        print(f"🔁 {rel}: {len({d[0] for d in diffs})} 行变化")
+
+    diff_path = results_base / DIFF_NAME
+    if all_diffs:
+        with open(diff_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, fieldnames=DIFF_FIELDS)
+            writer.writeheader()
+            writer.writerows(all_diffs)
+
+    print(f"\n📊 重解析 {stats['files']} 个文件 | 解析 {len(memo)} 条不同的原始输出 | "
+          f"{time.perf_counter() - start:.2f}s")
+    print(f"   变化: {stats['changed_rows']} 行 / {stats['changed_files']} 个文件 | "
+          f"PARSE_ERR 修复 {stats['fixed']} | 新增 PARSE_ERR {stats['broken']}")
+    if all_diffs:
+        print(f"💾 差异明细: {diff_path}" + (" (dry-run，未回写)" if args.dry_run else ""))
+    print("\n✨ 重解析完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,87 @@
+import os
 import json
-import csv
+import math
 import time
 import re
 import yaml
-import threading
-from pathlib import Path
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+from collections import Counter
+from functools import partial
+from openai import AsyncOpenAI
+from Collector.engine import sweep
+from Collector.cache import ResponseCache, fetch, print_cache_stats
+from Collector.limiter import AIMDRegistry, print_limits
+from Collector.providers import build_client, cached_prompt_tokens
+from Collector.nettrace import start_timing, net_columns, NET_FIELDS
+from Collector.retry import Retrier, call_with_retry, print_retry_stats
+from Collector.repair import repair_body, reask
+from Collector.ledger import CostLedger
 
 
 # --- 1. 配置加载 ---
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+
+
 def load_config():
+    """base_url 优先取环境变量 LLM_BASE_URL，其次 API_KEY.yaml 的 BASE_URL (可指向本地假服务)"""
     try:
         with open("Configs/API_KEY.yaml", "r", encoding="utf-8") as f:
-            api_key = yaml.safe_load(f).get("KEY")
+            key_cfg = yaml.safe_load(f)
+            api_key = key_cfg.get("KEY")
         with open("Configs/models.yaml", "r", encoding="utf-8") as f:
             models_data = yaml.safe_load(f)
             all_models = models_data.get("models", {})
-        return api_key, all_models
+        base_url = os.environ.get("LLM_BASE_URL") or key_cfg.get("BASE_URL") or DEFAULT_BASE_URL
+        return api_key, all_models, base_url
     except Exception as e:
         print(f"❌ 配置文件读取失败: {e}")
-        return None, None
+        return None, None, None
 
 
 # --- 2. 核心解析逻辑 ---
+# 解析器在采集时与离线重解析 (REPARSE.py) 中共用，正则预编译
+CODE_FENCE_RE = re.compile(r'```json\s*|```')
+S1_PIPE_RE = re.compile(r'(.*)\|\s*(\d+)')
+S1_ANSWER_RE = re.compile(r'"answer"\s*:\s*"((?:[^"\\]|\\.)*)"')
+S1_CONFIDENCE_RE = re.compile(r'"confidence"\s*:\s*"?(\d+)')
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _parse_s1_fields(text):
+    """JSON 后面跟了解释文字、或 JSON 本身残缺 (如 {"answer": "5"},"confidence": 100) 时按字段抽取；抽不到返回 None"""
+    confidence = S1_CONFIDENCE_RE.search(text)
+    conf = int(confidence.group(1)) if confidence else -1
+    start = text.find("{")
+    if start >= 0:
+        try:
+            data, _ = _JSON_DECODER.raw_decode(text, start)
+            if isinstance(data, dict) and "answer" in data:
+                return str(data["answer"]), conf
+        except ValueError:
+            pass
+    answer = S1_ANSWER_RE.search(text)
+    if answer:
+        try:
+            return json.loads(f'"{answer.group(1)}"'), conf
+        except ValueError:
+            return answer.group(1), conf
+    return None
+
+
 def parse_s1_output(raw_text):
     text = raw_text.strip()
-    text = re.sub(r'```json\s*|```', '', text).strip()
+    text = CODE_FENCE_RE.sub('', text).strip()
     ans, conf = "PARSE_ERR", -1
     try:
         data = json.loads(text)
         ans = str(data.get("answer", "PARSE_ERR"))
         conf = int(data.get("confidence", -1))
     except:
-        match = re.search(r'(.*)\|\s*(\d+)', text)
-        if match:
+        fields = _parse_s1_fields(text)
+        match = S1_PIPE_RE.search(text) if fields is None else None
+        if fields:
+            ans, conf = fields
+        elif match:
             ans = match.group(1).replace('[', '').replace(']', '').strip()
             try:
                 conf = int(match.group(2))
@@ -43,50 +90,267 @@ def parse_s1_output(raw_text):
     return ans, conf
 
 
+def normalize_answer(ans):
+    """比较用的答案归一化：小写、去空白与首尾标点、去千分位，数值统一写法 (如 "42.0" -> "42")"""
+    text = " ".join(str(ans).lower().split()).strip(" .。!?\"'`$")
+    number = text.replace(",", "")
+    try:
+        value = float(number)
+        return str(int(value)) if value.is_integer() else str(value)
+    except ValueError:
+        return text
+
+
 # --- 3. S1 任务执行 (增强版：记录消耗与延迟) ---
-def run_s1_task(task_id: int, question: str, model_id: str, client: OpenAI):
-    system_instruction = (
-        "You are an intuitive S1 engine. Respond instantly and concisely.\n"
-        "Format: {\"answer\": \"your_ans\", \"confidence\": 0-100}"
-    )
-
-    samples = []
-    total_prompt_tokens = 0
-    total_completion_tokens = 0
-    start_wall_time = time.perf_counter()  # 记录总耗时开始
+S1_SAMPLES = 3                  # 自洽性采样次数 k (adaptive 下为采样上限)
+S1_SAMPLING_MODE = "concurrent"  # concurrent: k 个请求并发 | n: 单请求 n=k | serial: 逐个采样 | adaptive: 见下
+S1_MIN_SAMPLES = 2               # adaptive：先并发采 S1_MIN_SAMPLES 个，按停止规则判断是否继续逐个加采
+S1_STOP_RULE = "majority"        # majority: 票数过上限一半 | margin:N: 领先第二名 N 票 | unanimous: 全部一致
+# 分歧时能否加采取决于规则与 k：unanimous 出现分歧即不可能再一致，从不加采；margin:N 需 k - S1_MIN_SAMPLES >= N；
+# majority 需 k > S1_MIN_SAMPLES。无法加采的组合在 adaptive 模式下直接报错 (见 check_stop_rule)
+S1_MAX_TOKENS = 80
+S1_TEMPERATURE = 0.3
+S1_LOGPROBS = True               # 请求 token logprobs 以计算困惑度等信号；供应商不返回时相关列留空
+S1_STRUCTURED = False            # 用 response_format (JSON schema) 强制输出 {answer, confidence}；模型不支持时退回正文解析
+S1_REPAIR = True                 # 解析失败的采样带上原回答追问一次 (低 max_tokens)，只要格式化的答案
+USE_CACHE = True                 # 命中本地响应缓存的请求不再付费
+FSYNC = False                    # 结果每次刷盘后 fsync 落到磁盘 (断电也不丢已写行，吞吐略降)
+HEDGE = False                    # 超过该模型近期 p95 仍未返回时补发一份对冲请求
+BUDGET_USD = None                # 本次运行的美元预算，None 为不限 (价格见 models.yaml 的 price)
+BUDGET_TOKENS = None             # 本次运行的 token 预算，None 为不限
+BUDGET_MODE = "stop"             # 模型级预算 (budget_usd) 用尽后：stop 停止该模型 | deprioritise 让出给其他模型
 
-    for _ in range(3):
-        try:
-            response = client.chat.completions.create(
-                model=model_id,
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": question}
-                ],
-                max_tokens=80,
-                temperature=0.3,
-                timeout=20
-            )
-            raw = response.choices[0].message.content
+S1_INSTRUCTION = (
+    "You are an intuitive S1 engine. Respond instantly and concisely.\n"
+    "Format: {\"answer\": \"your_ans\", \"confidence\": 0-100}"
+)
+
+S1_REPAIR_PROMPT = "Restate only the final answer from your reply above as {\"answer\": \"your_ans\", \"confidence\": 0-100}"
+
+S1_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "s1_answer",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answer": {"type": "string"},
+                "confidence": {"type": "integer", "description": "0-100"}
+            },
+            "required": ["answer", "confidence"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+def should_stop_sampling(answers, rule=S1_STOP_RULE, min_samples=S1_MIN_SAMPLES, max_samples=S1_SAMPLES):
+    """
+    顺序停止规则。answers 为已采到的答案 (解析失败记为 PARSE_ERR，视作不一致)。
+    规则已满足即停；剩余采样即使全投给领先答案也无法满足规则时同样停止，不再白花钱
+    """
+    if len(answers) < min_samples:
+        return False
+    if len(answers) >= max_samples:
+        return True
+    votes = Counter(normalize_answer(a) for a in answers if a != "PARSE_ERR").most_common(2)
+    lead = votes[0][1] if votes else 0
+    runner_up = votes[1][1] if len(votes) > 1 else 0
+    remaining = max_samples - len(answers)
+    kind, _, arg = rule.partition(":")
+    if kind == "unanimous":
+        return True  # 一致即停；出现分歧后再加采也不可能全部一致
+    if kind == "margin":
+        margin = int(arg or 2)
+        return lead - runner_up >= margin or lead + remaining - runner_up < margin
+    if kind == "majority":
+        return lead > max_samples / 2 or lead + remaining <= max_samples / 2
+    raise ValueError(f"未知停止规则: {rule}")
+
+
+def check_stop_rule(rule=S1_STOP_RULE, min_samples=S1_MIN_SAMPLES, max_samples=S1_SAMPLES):
+    """最少样本一分为二 (最小的分歧) 时规则必须允许继续加采，否则 adaptive 等同固定采 min_samples 次"""
+    split = ["a"] * ((min_samples + 1) // 2) + ["b"] * (min_samples // 2)
+    if min_samples < max_samples and should_stop_sampling(split, rule, min_samples, max_samples):
+        raise ValueError(f"停止规则 {rule} 在 min={min_samples}, k={max_samples} 下分歧时无法加采，"
+                         f"adaptive 退化为固定采样；请换用 majority 或增大 k")
+
+
+def logprob_signals(tokens, ans):
+    """
+    tokens: [(token, logprob), ...]。返回困惑度 exp(-平均 logprob)、平均 / 最小 token 概率，
+    以及答案片段 (与解析出的答案重叠的 token) 的联合概率；定位不到答案时该项留空
+    """
+    if not tokens:
+        return {}
+    lps = [lp for _, lp in tokens]
+    signals = {
+        "perplexity": round(math.exp(-sum(lps) / len(lps)), 4),
+        "mean_token_prob": round(sum(math.exp(lp) for lp in lps) / len(lps), 4),
+        "min_token_prob": round(math.exp(min(lps)), 4),
+        "answer_prob": ""
+    }
+    text = "".join(t for t, _ in tokens)
+    start = text.find(ans, text.find('"answer"') + 1) if ans and ans != "PARSE_ERR" else -1
+    if start >= 0:
+        end, offset, span = start + len(ans), 0, []
+        for token, lp in tokens:
+            if offset < end and offset + len(token) > start:
+                span.append(lp)
+            offset += len(token)
+        signals["answer_prob"] = round(math.exp(sum(span)), 4)
+    return signals
+
+
+def s1_body(question: str, model_id: str, n: int = 1):
+    """
+    S1 请求体 (在线请求与批处理导出共用)。
+    固定的 S1_INSTRUCTION 放最前、题目放最后，同一模型的所有请求共享同一前缀，便于供应商前缀缓存命中
+    """
+    body = {
+        "model": model_id,
+        "messages": [
+            {"role": "system", "content": S1_INSTRUCTION},
+            {"role": "user", "content": question}
+        ],
+        "max_tokens": S1_MAX_TOKENS,
+        "temperature": S1_TEMPERATURE
+    }
+    if n > 1:
+        body["n"] = n
+    if S1_LOGPROBS:
+        body["logprobs"] = True
+    if S1_STRUCTURED:
+        body["response_format"] = S1_SCHEMA
+    return body
+
+
+def s1_cache_key(question: str, model_id: str, n: int = 1, sample_idx: int = 0):
+    key = (model_id, S1_INSTRUCTION, question, S1_TEMPERATURE, S1_MAX_TOKENS, sample_idx, n, S1_LOGPROBS)
+    return key + ("json_schema",) if S1_STRUCTURED else key
+
+
+async def _s1_request(question: str, model_id: str, client: AsyncOpenAI, n: int):
+    start_time = time.perf_counter()
+    timings = start_timing()
+    response = await client.chat.completions.create(**s1_body(question, model_id, n), timeout=20)
+    return {
+        "contents": [choice.message.content for choice in response.choices],
+        "logprobs": [[(t.token, t.logprob) for t in choice.logprobs.content]
+                     if choice.logprobs and choice.logprobs.content else None for choice in response.choices],
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens,
+        "cached_tokens": cached_prompt_tokens(response.usage),
+        "latency_ms": int((time.perf_counter() - start_time) * 1000),
+        "net": dict(timings)
+    }
+
+
+async def repair_s1_sample(question: str, model_id: str, raw: str, client: AsyncOpenAI,
+                           cache: ResponseCache = None, retrier: Retrier = None):
+    """PARSE_ERR 的采样：接着原对话追问一次格式化答案。返回 (ans, conf, tokens, 是否命中缓存)"""
+    body = repair_body(s1_body(question, model_id), raw, S1_REPAIR_PROMPT)
+    content, tokens, cached = await reask(client, body, cache, retrier, "s1_repair")
+    ans, conf = parse_s1_output(content)
+    return ans, conf, tokens, cached
+
+
+async def _s1_call(question: str, model_id: str, client: AsyncOpenAI, n: int = 1,
+                   sample_idx: int = 0, cache: ResponseCache = None, retrier: Retrier = None):
+    """
+    单次请求 (可命中缓存、失败重试)，返回 (samples, prompt_tokens, completion_tokens, cached_tokens, billed)；
+    billed 为实付的 (prompt, completion, cached_prompt)，含修复追问。失败返回空采样
+    """
+    key_fields = s1_cache_key(question, model_id, n, sample_idx)
+
+    async def request():
+        start_time = time.perf_counter()
+        payload = await call_with_retry(retrier, (model_id, "s1"), lambda: _s1_request(question, model_id, client, n))
+        payload["latency_ms"] = int((time.perf_counter() - start_time) * 1000)  # 含重试退避与对冲等待
+        return payload
+
+    try:
+        payload, cached = await fetch(cache, key_fields, request)
+
+        samples = []
+        logprobs = payload.get("logprobs") or [None] * len(payload["contents"])
+        for raw, tokens in zip(payload["contents"], logprobs):
             ans, conf = parse_s1_output(raw)
+            samples.append({"ans": ans, "conf": conf, "raw": raw, "signals": logprob_signals(tokens, ans),
+                            "latency_ms": payload["latency_ms"], "net": payload.get("net"), "cached": cached,
+                            "repaired": False})
+
+        tokens = [payload["prompt_tokens"], payload["completion_tokens"], payload.get("cached_tokens", 0)]
+        billed = [0, 0, 0] if cached else list(tokens)
+        for s in samples:
+            if not (S1_REPAIR and s["ans"] == "PARSE_ERR" and s["raw"].strip()):
+                continue
+            try:
+                ans, conf, extra, extra_cached = await repair_s1_sample(question, model_id, s["raw"], client,
+                                                                        cache, retrier)
+            except Exception as e:
+                print(f"⚠️ S1 repair failed ({model_id}): {type(e).__name__}: {e}")
+                continue
+            for i in range(3):
+                tokens[i] += extra[i]
+                billed[i] += 0 if extra_cached else extra[i]
+            if ans != "PARSE_ERR":
+                s.update({"ans": ans, "conf": conf, "repaired": True})
+        return samples, tokens[0], tokens[1], tokens[2], tuple(billed)
+    except Exception as e:
+        print(f"⚠️ S1 sample failed ({model_id}): {type(e).__name__}: {e}")
+        return [], 0, 0, 0, (0, 0, 0)
+
 
-            # 累加 Token 消耗
-            total_prompt_tokens += response.usage.prompt_tokens
-            total_completion_tokens += response.usage.completion_tokens
+async def run_s1_task(task_id: int, question: str, model_id: str, client: AsyncOpenAI,
+                      k: int = S1_SAMPLES, mode: str = S1_SAMPLING_MODE, cache: ResponseCache = None,
+                      retrier: Retrier = None):
+    start_wall_time = time.perf_counter()  # 记录总耗时开始
+    call = partial(_s1_call, question, model_id, client, cache=cache, retrier=retrier)
 
-            samples.append({"ans": ans, "conf": conf, "raw": raw})
-        except:
-            continue
+    if mode == "serial":
+        results = [await call(sample_idx=i) for i in range(k)]
+    elif mode == "n":
+        # 单请求要 k 个 choices；供应商忽略 n 时用并发请求补齐
+        results = [await call(n=k)]
+        got = len(results[0][0])
+        if got < k:
+            results += await asyncio.gather(*(call(sample_idx=i) for i in range(got, k)))
+    elif mode == "adaptive":
+        # 先并发采最少样本，满足停止规则即停；否则逐个加采，最多 k 个
+        check_stop_rule(S1_STOP_RULE, S1_MIN_SAMPLES, k)
+        results = list(await asyncio.gather(*(call(sample_idx=i) for i in range(min(S1_MIN_SAMPLES, k)))))
+        while len(results) < k and not should_stop_sampling([s['ans'] for r in results for s in r[0]],
+                                                             S1_STOP_RULE, S1_MIN_SAMPLES, k):
+            results.append(await call(sample_idx=len(results)))
+    else:
+        results = await asyncio.gather(*(call(sample_idx=i) for i in range(k)))
 
+    samples = [s for r in results for s in r[0]][:k]
     if not samples:
         return None
 
-    # 计算总延迟 (毫秒)
-    total_latency_ms = int((time.perf_counter() - start_wall_time) * 1000)
+    # 累加 Token 消耗
+    total_prompt_tokens = sum(r[1] for r in results)
+    total_completion_tokens = sum(r[2] for r in results)
+
+    # 计算总延迟 (毫秒)；全部命中缓存时回放原始延迟
+    if all(s['cached'] for s in samples):
+        latencies = [s['latency_ms'] for s in samples]
+        if mode == "serial":
+            total_latency_ms = sum(latencies)
+        elif mode == "adaptive":
+            total_latency_ms = max(latencies[:S1_MIN_SAMPLES]) + sum(latencies[S1_MIN_SAMPLES:])
+        else:
+            total_latency_ms = max(latencies)
+    else:
+        total_latency_ms = int((time.perf_counter() - start_wall_time) * 1000)
 
     valid_answers = [s['ans'] for s in samples if s['ans'] != "PARSE_ERR"]
     unique_answers = set(valid_answers)
     primary = samples[0]
+    signals = primary['signals']
 
     return {
         "id": task_id,
@@ -98,67 +362,55 @@ def run_s1_task(task_id: int, question: str, model_id: str, client: OpenAI):
         "prompt_tokens": total_prompt_tokens,  # 核心指标 2：输入 Token
         "completion_tokens": total_completion_tokens,  # 核心指标 3：输出 Token
         "s1_raw_output": primary['raw'].replace('\n', ' '),
-        "samples_count": len(samples)
+        "samples_count": len(samples),
+        "sample_latencies_ms": "|".join(str(s['latency_ms']) for s in samples),  # 每个采样的单次延迟
+        "s1_perplexity": signals.get("perplexity", ""),  # 以下为主采样的 logprob 信号
+        "s1_mean_token_prob": signals.get("mean_token_prob", ""),
+        "s1_min_token_prob": signals.get("min_token_prob", ""),
+        "s1_answer_prob": signals.get("answer_prob", ""),
+        **net_columns(primary['net']),  # 主采样请求的网络分段耗时
+        "cached_prompt_tokens": sum(r[3] for r in results),  # 命中供应商前缀缓存的输入 Token
+        "s1_repaired": sum(s['repaired'] for s in samples),  # 经修复追问拿回答案的采样数
+        "_billed": tuple(sum(r[4][i] for r in results) for i in range(3)),  # 仅记账，不写入 CSV
+        "_calls": len(results),  # 实际发出的请求数，供去重统计
+        "_cached": any(s['cached'] for s in samples),  # 含缓存回放的采样，延迟不是本次实测
+        "_sample_answers": [s['ans'] for s in samples]  # 供级联路由计算自洽性，不写入 CSV
     }
 
 
 # --- 4. 主控流程 ---
-csv_lock = threading.Lock()
+FIELDNAMES = [
+    "id", "task", "s1_answer", "s1_confidence",
+    "consistency_entropy", "latency_ms", "prompt_tokens",
+    "completion_tokens", "s1_raw_output", "samples_count",
+    "sample_latencies_ms", "s1_perplexity", "s1_mean_token_prob",
+    "s1_min_token_prob", "s1_answer_prob"
+] + NET_FIELDS + ["cached_prompt_tokens", "s1_repaired"]
 
 
-def main():
-    api_key, all_models = load_config()
+async def main_async():
+    api_key, all_models, base_url = load_config()
     if not api_key: return
 
-    client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
-    data_dir = Path("Data")
-    results_base = Path("Results")
-
-    for json_f in data_dir.glob("*.json"):
-        dataset_name = json_f.stem
-        with open(json_f, 'r', encoding='utf-8') as j:
-            tasks = [{"id": i, "question": (item.get("task") or item.get("question"))}
-                     for i, item in enumerate(json.load(j))]
-
-        for model_key, info in all_models.items():
-            model_id = info['id']
-            file_path = results_base / model_key / "Splits" / f"{model_key}_{dataset_name}_s1.csv"
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-
-            completed_ids = set()
-            if file_path.exists():
-                with open(file_path, "r", encoding="utf-8-sig") as f:
-                    reader = csv.DictReader(f)
-                    for row in reader: completed_ids.add(int(row["id"]))
-
-            todo_tasks = [t for t in tasks if t["id"] not in completed_ids]
-            if not todo_tasks: continue
-
-            print(f"🚀 Running S1: {model_key} | Dataset: {dataset_name} | Tasks: {len(todo_tasks)}")
-
-            # 这里的 fieldnames 必须包含新增的三个指标
-            fieldnames = [
-                "id", "task", "s1_answer", "s1_confidence",
-                "consistency_entropy", "latency_ms", "prompt_tokens",
-                "completion_tokens", "s1_raw_output", "samples_count"
-            ]
-
-            with ThreadPoolExecutor(max_workers=15) as executor:
-                future_to_id = {executor.submit(run_s1_task, t["id"], t["question"], model_id, client): t["id"] for t in
-                                todo_tasks}
-
-                for future in as_completed(future_to_id):
-                    res = future.result()
-                    if res:
-                        with csv_lock:
-                            is_new = not file_path.exists() or file_path.stat().st_size == 0
-                            with open(file_path, "a", newline="", encoding="utf-8-sig") as f:
-                                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                                if is_new: writer.writeheader()
-                                writer.writerow(res)
+    limiters = AIMDRegistry(all_models)
+    client = build_client(all_models, limiters, api_key, base_url)  # 每个 provider 一个连接池
+    await client.warmup()
+    cache = ResponseCache() if USE_CACHE else None
+    retrier = Retrier(hedge=HEDGE)
+    ledger = CostLedger(all_models, "s1", budget_usd=BUDGET_USD, budget_tokens=BUDGET_TOKENS)
+    await sweep("s1", "🚀 Running S1", partial(run_s1_task, cache=cache, retrier=retrier),
+                FIELDNAMES, all_models, client, fsync=FSYNC, ledger=ledger, budget_mode=BUDGET_MODE)
+    print_limits(limiters)
+    print_retry_stats(retrier)
+    if cache:
+        print_cache_stats(cache)
 
     print("\n✨ S1 数据采集全部完成（含消耗与延迟指标）！")
 
 
+def main():
+    asyncio.run(main_async())
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
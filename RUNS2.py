@@ -1,69 +1,262 @@
-import json
-import csv
+import os
 import time
 import re
+import json
 import yaml
-import threading
-from pathlib import Path
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+from functools import partial
+from openai import AsyncOpenAI
+from Collector.engine import sweep
+from Collector.cache import ResponseCache, fetch, print_cache_stats
+from Collector.limiter import AIMDRegistry, print_limits
+from Collector.providers import build_client, cached_prompt_tokens
+from Collector.nettrace import start_timing, net_columns, NET_FIELDS
+from Collector.retry import Retrier, call_with_retry, print_retry_stats
+from Collector.repair import repair_body, reask
+from Collector.ledger import CostLedger, token_count
 
 
 # --- 1. 配置加载 ---
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+
+
 def load_config():
+    """base_url 优先取环境变量 LLM_BASE_URL，其次 API_KEY.yaml 的 BASE_URL (可指向本地假服务)"""
     try:
         with open("Configs/API_KEY.yaml", "r", encoding="utf-8") as f:
-            api_key = yaml.safe_load(f).get("KEY")
+            key_cfg = yaml.safe_load(f)
+            api_key = key_cfg.get("KEY")
         with open("Configs/models.yaml", "r", encoding="utf-8") as f:
             all_models = yaml.safe_load(f).get("models", {})
-        return api_key, all_models
+        base_url = os.environ.get("LLM_BASE_URL") or key_cfg.get("BASE_URL") or DEFAULT_BASE_URL
+        return api_key, all_models, base_url
     except Exception as e:
         print(f"❌ 配置文件读取失败: {e}")
-        return None, None
+        return None, None, None
 
 
 # --- 2. S2 专用解析逻辑 ---
+FINAL_ANSWER_RE = re.compile(r"Final Answer:\s*(?:\*\*\s*)?(.*)", re.IGNORECASE)  # "**Final Answer:**" 后答案可能另起一行
+CONFIDENCE_RE = re.compile(r"\d+")
+
+
 def parse_s2_output(text):
-    """提取 Final Answer 之后的答案和置信度"""
-    match = re.search(r"Final Answer:\s*(.*)", text, re.IGNORECASE)
+    """
+    提取 Final Answer 之后的答案和置信度。
+    去掉模型照抄格式留下的 [ ] 与 markdown 加粗；置信度只取数字 ("[Confidence Score: 95]" -> "95")。
+    结构化输出模式下回答是 {reasoning, answer, confidence} JSON，直接取字段
+    """
+    if text.lstrip().startswith("{"):
+        try:
+            data = json.loads(text)
+            return str(data["answer"]).strip() or "PARSE_ERR", str(int(data["confidence"]))
+        except (ValueError, KeyError, TypeError):
+            pass
+    match = FINAL_ANSWER_RE.search(text)
     if match:
         full_ans_line = match.group(1).strip()
+        while full_ans_line.lower().startswith("final answer:"):  # "**Final Answer:** Final Answer: [8 days]"
+            full_ans_line = full_ans_line[len("final answer:"):].strip()
         parts = full_ans_line.split('|')
-        ans = parts[0].strip()
-        conf = parts[1].strip() if len(parts) > 1 else "-1"
-        return ans, conf
+        ans = parts[0].replace("**", "").strip()
+        if ans.startswith("[") and ans.endswith("]"):
+            ans = ans[1:-1].strip()
+        confidence = CONFIDENCE_RE.search(parts[1]) if len(parts) > 1 else None
+        conf = confidence.group() if confidence else "-1"
+        return ans or "PARSE_ERR", conf
 
     lines = [l for l in text.split('\n') if l.strip()]
     return (lines[-1][:100], "-1") if lines else ("PARSE_ERR", "-1")
 
 
+def s2_answer_missing(text):
+    """没有 Final Answer 行 (也不是结构化 JSON)：parse_s2_output 只能退回取最后一行"""
+    if text.lstrip().startswith("{"):
+        try:
+            return "answer" not in json.loads(text)
+        except ValueError:
+            pass
+    return not FINAL_ANSWER_RE.search(text)
+
+
 # --- 3. S2 任务执行 (含全量指标采集) ---
-def run_s2_task(task_id: int, question: str, model_id: str, client: OpenAI):
-    s2_instruction = (
-        "You are a deliberative System 2. Solve the question using the Alpha-Beta protocol.\n"
-        "Phase 1 (Alpha): Solve the question step-by-step with deep reasoning.\n"
-        "Phase 2 (Beta): Review your reasoning for logical traps or intuitive biases.\n\n"
-        "Format your response as follows:\n"
-        "Reasoning: <your_thought_process>\n"
-        "Final Answer: [Result] | [Confidence Score 0-100]"
-    )
+S2_MAX_TOKENS = 1024
+S2_TEMPERATURE = 0.7
+S2_STREAM = False  # 流式：记录首 token 延迟，读到完整的 Final Answer 行即断开 (拿不到 usage，token 数为估算)
+S2_STRUCTURED = False  # 用 response_format (JSON schema) 强制输出 {reasoning, answer, confidence}；模型不支持时退回正文解析
+S2_REPAIR = True       # 没有 Final Answer 行 (推理被截断等) 时带上原回答追问一次，不重跑整段推理
+USE_CACHE = True  # 命中本地响应缓存的请求不再付费
+FSYNC = False     # 结果每次刷盘后 fsync 落到磁盘 (断电也不丢已写行，吞吐略降)
+HEDGE = False     # 超过该模型近期 p95 仍未返回时补发一份对冲请求
+BUDGET_USD = None     # 本次运行的美元预算，None 为不限 (价格见 models.yaml 的 price)
+BUDGET_TOKENS = None  # 本次运行的 token 预算，None 为不限
+BUDGET_MODE = "stop"  # 模型级预算 (budget_usd) 用尽后：stop 停止该模型 | deprioritise 让出给其他模型
+
+S2_INSTRUCTION = (
+    "You are a deliberative System 2. Solve the question using the Alpha-Beta protocol.\n"
+    "Phase 1 (Alpha): Solve the question step-by-step with deep reasoning.\n"
+    "Phase 2 (Beta): Review your reasoning for logical traps or intuitive biases.\n\n"
+    "Format your response as follows:\n"
+    "Reasoning: <your_thought_process>\n"
+    "Final Answer: [Result] | [Confidence Score 0-100]"
+)
+
+S2_REPAIR_PROMPT = ("Give only your final answer to the question above, in the format:\n"
+                    "Final Answer: [Result] | [Confidence Score 0-100]")
+
+S2_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "s2_answer",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "reasoning": {"type": "string", "description": "Alpha solution followed by the Beta review"},
+                "answer": {"type": "string"},
+                "confidence": {"type": "integer", "description": "0-100"}
+            },
+            "required": ["reasoning", "answer", "confidence"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# 置信度数字之后出现任意非数字字符，才算 Final Answer 行已完整
+FINAL_LINE_DONE = re.compile(r"Final Answer:[^\n]*\|\s*\[?\d+[^\d]", re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    """按约 4 字符 / token 粗估，供应商没有返回 usage 时用于记账"""
+    return max(1, len(text) // 4)
+
+
+def s2_body(user_content: str, model_id: str):
+    """S2 请求体 (在线请求与批处理导出共用)；较长的 S2_INSTRUCTION 作为固定前缀放最前，利于供应商前缀缓存"""
+    body = {
+        "model": model_id,
+        "messages": [
+            {"role": "system", "content": S2_INSTRUCTION},
+            {"role": "user", "content": user_content}
+        ],
+        "max_tokens": S2_MAX_TOKENS,
+        "temperature": S2_TEMPERATURE
+    }
+    if S2_STRUCTURED:
+        body["response_format"] = S2_SCHEMA
+    return body
+
 
+def s2_cache_key(question: str, model_id: str):
+    key = (model_id, S2_INSTRUCTION, f"Question: {question}", S2_TEMPERATURE, S2_MAX_TOKENS, 0, 1)
+    return key + ("json_schema",) if S2_STRUCTURED else key
+
+
+async def _s2_request(user_content: str, model_id: str, client: AsyncOpenAI, progress=None):
+    start_time = time.perf_counter()
+    timings = start_timing()
+    response = await client.chat.completions.create(**s2_body(user_content, model_id), timeout=60)
+    return {
+        "contents": [response.choices[0].message.content],
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens,
+        "cached_tokens": cached_prompt_tokens(response.usage),
+        "latency_ms": int((time.perf_counter() - start_time) * 1000),
+        "ttft_ms": "",
+        "tokens_per_s": "",
+        "stop_reason": response.choices[0].finish_reason,
+        "net": dict(timings)
+    }
+
+
+async def _s2_stream_request(user_content: str, model_id: str, client: AsyncOpenAI, progress=None):
+    """
+    流式读取：记录首 token 延迟 (TTFT) 与之后的出 token 速率；
+    Final Answer 行带上 | 置信度 读完整后立即关闭连接，剩余 token 不再等待。
+    提前断开时拿不到 usage，completion_tokens 以收到的内容块数估算，prompt_tokens 留空 (由 run_s2_task 按提示词长度估算)。
+    progress (Counter) 记录已被受理的请求数与收到的内容块数，供被取消的推测请求估算浪费的 token。
+    """
+    start_time = time.perf_counter()
+    timings = start_timing()
+    stream = await client.chat.completions.create(**s2_body(user_content, model_id), timeout=60,
+                                                  stream=True, stream_options={"include_usage": True})
+    headers_at = time.perf_counter()
+    if progress is not None:
+        progress["requests"] += 1
+
+    parts, usage, stop_reason = [], None, None
+    first_at = last_at = None
     try:
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                last_at = time.perf_counter()
+                first_at = first_at or last_at
+                parts.append(choice.delta.content)
+                if progress is not None:
+                    progress["chunks"] += 1
+            if choice.finish_reason:
+                stop_reason = choice.finish_reason
+            if stop_reason is None and FINAL_LINE_DONE.search("".join(parts[-64:])):
+                stop_reason = "final_answer"
+                break
+    finally:
+        await stream.close()
+
+    n_chunks = len(parts)
+    return {
+        "contents": ["".join(parts)],
+        "prompt_tokens": usage.prompt_tokens if usage else "",
+        "completion_tokens": usage.completion_tokens if usage else n_chunks,
+        "cached_tokens": cached_prompt_tokens(usage) if usage else "",
+        "latency_ms": int((time.perf_counter() - start_time) * 1000),
+        "ttft_ms": int((first_at - start_time) * 1000) if first_at else "",
+        "tokens_per_s": round((n_chunks - 1) / (last_at - first_at), 1) if n_chunks > 1 and last_at > first_at else "",
+        "stop_reason": stop_reason or "eof",
+        # 提前断开时 httpcore 不会及时给出 body 阶段的结束事件，传输时间按收到响应头到读完为止计
+        "net": {"transfer_ms": int((time.perf_counter() - headers_at) * 1000), **timings}
+    }
+
+
+async def run_s2_task(task_id: int, question: str, model_id: str, client: AsyncOpenAI,
+                      cache: ResponseCache = None, stream: bool = S2_STREAM, retrier: Retrier = None,
+                      progress=None):
+    user_content = f"Question: {question}"
+    key_fields = s2_cache_key(question, model_id)
+    send = _s2_stream_request if stream else _s2_request
+
+    async def request():
         start_time = time.perf_counter()
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=[
-                {"role": "system", "content": s2_instruction},
-                {"role": "user", "content": f"Question: {question}"}
-            ],
-            max_tokens=1024,
-            temperature=0.7,
-            timeout=60
-        )
-        latency_ms = int((time.perf_counter() - start_time) * 1000)
-        raw_content = response.choices[0].message.content
+        payload = await call_with_retry(retrier, (model_id, "s2"), lambda: send(user_content, model_id, client, progress))
+        payload["latency_ms"] = int((time.perf_counter() - start_time) * 1000)  # 含重试退避与对冲等待
+        return payload
+
+    try:
+        payload, cached = await fetch(cache, key_fields, request)
+        raw_content = payload["contents"][0]
 
         ans, conf = parse_s2_output(raw_content)
+        tokens = [payload["prompt_tokens"], payload["completion_tokens"], payload.get("cached_tokens", "")]
+        estimated = int(tokens[0] in ("", None))
+        if estimated:  # 流式提前断开没有 usage：按提示词长度估算输入 token，账本与级联开销不至于漏记
+            tokens[0] = estimate_tokens(S2_INSTRUCTION + user_content)
+        billed = [0, 0, 0] if cached else [token_count(t) for t in tokens]
+        repaired = 0
+        if S2_REPAIR and raw_content.strip() and s2_answer_missing(raw_content):
+            try:
+                body = repair_body(s2_body(user_content, model_id), raw_content, S2_REPAIR_PROMPT)
+                content, extra, extra_cached = await reask(client, body, cache, retrier, "s2_repair")
+                if not s2_answer_missing(content):
+                    ans, conf = parse_s2_output(content)
+                    repaired = 1
+                tokens = [token_count(t) + e for t, e in zip(tokens, extra)]
+                billed = [b + (0 if extra_cached else e) for b, e in zip(billed, extra)]
+            except Exception as e:
+                print(f"⚠️ S2 repair failed ({model_id}): {type(e).__name__}: {e}")
 
         return {
             "id": task_id,
@@ -71,10 +264,19 @@ def run_s2_task(task_id: int, question: str, model_id: str, client: OpenAI):
             "s2_answer": ans,
             "s2_confidence": conf,
             "s2_reasoning": raw_content.replace('\n', '  '),
-            "latency_ms": latency_ms,
-            "prompt_tokens": response.usage.prompt_tokens,
-            "completion_tokens": response.usage.completion_tokens,
-            "s2_raw_output": raw_content.replace('\n', ' ')  # 完整原始回答
+            "latency_ms": payload["latency_ms"],
+            "prompt_tokens": tokens[0],
+            "completion_tokens": tokens[1],
+            "s2_raw_output": raw_content.replace('\n', ' '),  # 完整原始回答
+            "ttft_ms": payload.get("ttft_ms", ""),
+            "tokens_per_s": payload.get("tokens_per_s", ""),
+            "stop_reason": payload.get("stop_reason", ""),
+            **net_columns(payload.get("net")),
+            "cached_prompt_tokens": tokens[2],  # 命中供应商前缀缓存的输入 Token
+            "s2_repaired": repaired,  # 答案来自修复追问
+            "tokens_estimated": estimated,  # 1: 流式提前断开，token 数为估算值
+            "_billed": tuple(billed),  # 仅记账
+            "_cached": cached  # 缓存回放，latency_ms 为历史延迟
         }
     except Exception as e:
         print(f"⚠️ Task {task_id} failed: {e}")
@@ -82,61 +284,38 @@ def run_s2_task(task_id: int, question: str, model_id: str, client: OpenAI):
 
 
 # --- 4. 主控流程 ---
-csv_lock = threading.Lock()
+FIELDNAMES = [
+    "id", "task", "s2_answer", "s2_confidence",
+    "latency_ms", "prompt_tokens", "completion_tokens",
+    "s2_reasoning", "s2_raw_output",
+    "ttft_ms", "tokens_per_s", "stop_reason"
+] + NET_FIELDS + ["cached_prompt_tokens", "s2_repaired", "tokens_estimated"]
 
 
-def main():
-    api_key, all_models = load_config()
+async def main_async():
+    api_key, all_models, base_url = load_config()
     if not api_key: return
-    client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
-
-    data_dir = Path("Data")
-    results_base = Path("Results")
-
-    for json_f in data_dir.glob("*.json"):
-        dataset_name = json_f.stem
-        with open(json_f, 'r', encoding='utf-8') as j:
-            tasks = [{"id": i, "question": (item.get("task") or item.get("question"))}
-                     for i, item in enumerate(json.load(j))]
-
-        for model_key, info in all_models.items():
-            model_id = info['id']
-            file_path = results_base / model_key / "Splits" / f"{model_key}_{dataset_name}_s2.csv"
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-
-            completed_ids = set()
-            if file_path.exists():
-                with open(file_path, "r", encoding="utf-8-sig") as f:
-                    reader = csv.DictReader(f)
-                    for row in reader: completed_ids.add(int(row["id"]))
-
-            todo_tasks = [t for t in tasks if t["id"] not in completed_ids]
-            if not todo_tasks: continue
-
-            print(f"🧠 Running S2: {model_key} | Dataset: {dataset_name} | Tasks: {len(todo_tasks)}")
-
-            # 更新后的字段集
-            fieldnames = [
-                "id", "task", "s2_answer", "s2_confidence",
-                "latency_ms", "prompt_tokens", "completion_tokens",
-                "s2_reasoning", "s2_raw_output"
-            ]
-
-            with ThreadPoolExecutor(max_workers=15) as executor:
-                futures = {executor.submit(run_s2_task, t["id"], t["question"], model_id, client): t["id"] for t in
-                           todo_tasks}
-                for future in as_completed(futures):
-                    res = future.result()
-                    if res:
-                        with csv_lock:
-                            is_new = not file_path.exists() or file_path.stat().st_size == 0
-                            with open(file_path, "a", newline="", encoding="utf-8-sig") as f:
-                                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                                if is_new: writer.writeheader()
-                                writer.writerow(res)
+    limiters = AIMDRegistry(all_models)
+    client = build_client(all_models, limiters, api_key, base_url)  # 每个 provider 一个连接池
+    await client.warmup()
+
+    cache = ResponseCache() if USE_CACHE else None
+    retrier = Retrier(hedge=HEDGE)
+    ledger = CostLedger(all_models, "s2", budget_usd=BUDGET_USD, budget_tokens=BUDGET_TOKENS)
+
+    await sweep("s2", "🧠 Running S2", partial(run_s2_task, cache=cache, retrier=retrier),
+                FIELDNAMES, all_models, client, fsync=FSYNC, ledger=ledger, budget_mode=BUDGET_MODE)
+    print_limits(limiters)
+    print_retry_stats(retrier)
+    if cache:
+        print_cache_stats(cache)
 
     print("\n✨ S2 数据采集全部完成！")
 
 
+def main():
+    asyncio.run(main_async())
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import asyncio
+from functools import partial
+import RUNS1
+import RUNS2
+from Collector.engine import build_jobs, run_jobs
+from Collector.limiter import AIMDRegistry, print_limits
+from Collector.providers import build_client
+from Collector.cache import ResponseCache, print_cache_stats
+from Collector.retry import Retrier, print_retry_stats
+from Collector.ledger import CostLedger
+
+
+# --- S1 + S2 统一采集：一个全局调度器覆盖 数据集 × 模型 × 任务 × 系统 ---
+async def main_async():
+    api_key, all_models, base_url = RUNS1.load_config()
+    if not api_key: return
+
+    limiters = AIMDRegistry(all_models)
+    client = build_client(all_models, limiters, api_key, base_url)  # 每个 provider 一个连接池
+    await client.warmup()
+    cache = ResponseCache() if RUNS1.USE_CACHE else None
+    retrier = Retrier(hedge=RUNS1.HEDGE)
+    run_s1 = partial(RUNS1.run_s1_task, cache=cache, retrier=retrier)
+    run_s2 = partial(RUNS2.run_s2_task, cache=cache, retrier=retrier)
+    jobs = (build_jobs("s1", "🚀 Queued S1", run_s1, RUNS1.FIELDNAMES, all_models)
+            + build_jobs("s2", "🧠 Queued S2", run_s2, RUNS2.FIELDNAMES, all_models))
+    if not jobs:
+        return print("✅ 没有待采集的任务")
+
+    print(f"📦 全局队列共 {len(jobs)} 个作业")
+    ledger = CostLedger(all_models, "s1+s2", budget_usd=RUNS1.BUDGET_USD, budget_tokens=RUNS1.BUDGET_TOKENS)
+    await run_jobs(jobs, all_models, client, fsync=RUNS1.FSYNC, ledger=ledger, budget_mode=RUNS1.BUDGET_MODE)
+    print_limits(limiters)
+    print_retry_stats(retrier)
+    if cache:
+        print_cache_stats(cache)
+
+    print("\n✨ S1 + S2 数据采集全部完成！")
+
+
+def main():
+    asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    main()
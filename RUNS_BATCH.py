@@ -0,0 +1,253 @@
+"""
+离线批处理模式：把待跑的 S1 / S2 / 裁判请求导出为 OpenAI Batch JSONL，结果回来后按 custom_id 写回 Results。
+批处理通常半价，且不占在线接口的限流额度，适合大规模全量采集。
+
+    python RUNS_BATCH.py export [--systems s1 s2 judge]          # 写出 Batch/batch_<时间>_NNN.jsonl + manifest
+    python RUNS_BATCH.py submit Batch/batch_xxx_001.jsonl        # 上传并创建批处理任务 (需供应商支持 Batch API)
+    python RUNS_BATCH.py download <batch_id> Batch/out.jsonl     # 任务完成后下载结果
+    python RUNS_BATCH.py fake Batch/batch_xxx_001.jsonl Batch/out.jsonl   # 本地假批处理，测试用
+    python RUNS_BATCH.py ingest Batch/batch_xxx.manifest.json Batch/out.jsonl [...]
+
+S1 / S2 结果先按在线请求相同的键写入响应缓存，再用缓存回放跑一遍标准采集流程写 CSV (解析、表头、完成索引与在线一致)；
+S1 按 S1_SAMPLES 个并发采样导出。裁判结果直接按 custom_id 回写对应 CSV 的 T_F 列。
+"""
+import argparse
+import asyncio
+import csv
+import json
+from collections import defaultdict
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+from openai import OpenAI
+import RUNS1
+import RUNS2
+import API_JUDGE
+from Collector.batch import write_batch, read_results, payload_from_body, fake_process, batch_line, ENDPOINT
+from Collector.cache import ResponseCache, print_cache_stats
+from Collector.engine import build_jobs, run_jobs
+from Collector.ledger import CostLedger, print_ledger
+
+BATCH_PRICE_SCALE = 0.5  # 批处理接口相对在线价格的折扣，用于开销账本
+
+
+# --- 1. 导出待跑请求 ---
+def _job_cache_key(job, idx=0):
+    t = job["task"]
+    if job["system"] == "s1":
+        return ResponseCache.key(*RUNS1.s1_cache_key(t["question"], job["model_id"], 1, idx))
+    return ResponseCache.key(*RUNS2.s2_cache_key(t["question"], job["model_id"]))
+
+
+def _job_keys(job):
+    """作业需要的全部缓存键：S1 每个自洽性采样一个，S2 一个"""
+    if job["system"] == "s1":
+        return [_job_cache_key(job, idx) for idx in range(RUNS1.S1_SAMPLES)]
+    return [_job_cache_key(job)]
+
+
+def export_model_requests(all_models, systems):
+    """跨数据集重复的题目 (缓存键相同) 只导出一次，导入时回放到所有需要它的行"""
+    lines, manifest, exported = [], {}, set()
+    if "s1" in systems:
+        for job in build_jobs("s1", "📝 Export S1", None, RUNS1.FIELDNAMES, all_models):
+            t = job["task"]
+            for idx in range(RUNS1.S1_SAMPLES):
+                key = _job_cache_key(job, idx)
+                if key in exported: continue
+                exported.add(key)
+                cid = f"s1:{job['model_key']}:{job['dataset']}:{t['id']}:{idx}"
+                lines.append(batch_line(cid, RUNS1.s1_body(t["question"], job["model_id"])))
+                manifest[cid] = {"key": key}
+    if "s2" in systems:
+        for job in build_jobs("s2", "📝 Export S2", None, RUNS2.FIELDNAMES, all_models):
+            t = job["task"]
+            key = _job_cache_key(job)
+            if key in exported: continue
+            exported.add(key)
+            cid = f"s2:{job['model_key']}:{job['dataset']}:{t['id']}"
+            lines.append(batch_line(cid, RUNS2.s2_body(f"Question: {t['question']}", job["model_id"])))
+            manifest[cid] = {"key": key}
+    return lines, manifest
+
+
+def export_judge_requests(results_base=Path("Results"), si_json_path=Path("Data/si.json")):
+    """尚无 True / False 判定、且能匹配到标准答案的行"""
+    lines, manifest = [], {}
+    if not si_json_path.exists():
+        return lines, manifest
+    ground_truth = API_JUDGE.load_ground_truth(si_json_path)
+    for csv_f in results_base.rglob("*.csv"):
+        if "_si_" not in csv_f.name.lower() or "_completed" in csv_f.name:
+            continue
+        ans_col, raw_col = API_JUDGE.judge_columns(csv_f.name)
+        rel = csv_f.relative_to(results_base).as_posix()
+        with open(csv_f, "r", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                correct_ans = ground_truth.get(API_JUDGE.super_normalize(row.get("task", "")))
+                if correct_ans is None or row.get("T_F") in ("True", "False"):
+                    continue
+                cid = f"judge:{rel}:{row['id']}"
+                body = API_JUDGE.judge_body(row["task"], row[ans_col], row[raw_col] or row.get("s1_raw_output", ""),
+                                            correct_ans)
+                lines.append(batch_line(cid, body))
+                manifest[cid] = {"file": rel, "id": row["id"], "correct": correct_ans}
+    return lines, manifest
+
+
+def export(systems):
+    _, all_models, _ = RUNS1.load_config()
+    if all_models is None: return
+    lines, manifest = export_model_requests(all_models, systems)
+    if "judge" in systems:
+        judge_lines, judge_manifest = export_judge_requests()
+        lines += judge_lines
+        manifest.update(judge_manifest)
+    if not lines:
+        return print("✅ 没有待导出的请求")
+
+    paths, manifest_path = write_batch(lines, manifest)
+    print(f"📦 导出 {len(lines)} 条请求 -> {', '.join(str(p) for p in paths)}")
+    print(f"🗂️ Manifest: {manifest_path}")
+
+
+# --- 2. 提交 / 下载 (供应商 Batch API) ---
+def _sync_client():
+    api_key, _, base_url = RUNS1.load_config()
+    return OpenAI(base_url=base_url, api_key=api_key) if api_key else None
+
+
+def submit(input_path):
+    client = _sync_client()
+    if not client: return
+    with open(input_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h")
+    print(f"🚀 已提交批处理: {batch.id} | 状态: {batch.status}")
+
+
+def download(batch_id, output_path):
+    client = _sync_client()
+    if not client: return
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return print(f"⏳ 批处理 {batch_id} 状态: {batch.status}")
+    client.files.content(batch.output_file_id).write_to_file(output_path)
+    print(f"💾 结果已下载: {output_path}")
+
+
+# --- 3. 导入结果 ---
+async def _offline_create(**kwargs):
+    raise LookupError("该请求不在批处理结果中")
+
+
+def ingest_judge(verdicts, results_base=Path("Results")):
+    """verdicts: {相对路径: {id: (correct, T_F)}}，原地回写"""
+    for rel, by_id in verdicts.items():
+        csv_f = results_base / rel
+        with open(csv_f, "r", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            fieldnames = list(reader.fieldnames)
+            rows = list(reader)
+        if "correct" not in fieldnames: fieldnames.append("correct")
+        if "T_F" not in fieldnames: fieldnames.append("T_F")
+        for row in rows:
+            if row["id"] in by_id:
+                row["correct"], row["T_F"] = by_id[row["id"]]
+        with open(csv_f, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"⚖️ 裁判结果回写: {rel} | {len(by_id)} 行")
+
+
+async def ingest(manifest_path, output_paths):
+    _, all_models, _ = RUNS1.load_config()
+    if all_models is None: return
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    bodies, failed = read_results(output_paths)
+    print(f"📥 读取 {len(bodies)} 条结果 | 失败 {failed} 条")
+
+    cache = ResponseCache()
+    ledger = CostLedger(all_models, "batch", price_scale=BATCH_PRICE_SCALE)
+    judge_key = ledger.key_by_id.get(API_JUDGE.JUDGE_MODEL, API_JUDGE.JUDGE_MODEL)
+    done, verdicts = set(), defaultdict(dict)  # done: 已拿到结果的缓存键
+    for cid, body in bodies.items():
+        entry = manifest.get(cid)
+        if entry is None:
+            continue
+        payload = payload_from_body(body)
+        system, rest = cid.split(":", 1)
+        if system == "judge":
+            verdicts[entry["file"]][entry["id"]] = (entry["correct"], API_JUDGE.parse_verdict(payload["contents"][0]))
+            ledger.record(judge_key, Path(entry["file"]).stem, "judge", payload["prompt_tokens"],
+                          payload["completion_tokens"], payload["cached_tokens"])
+            continue
+        model_key, dataset = rest.split(":")[:2]
+        cache.put(entry["key"], payload)
+        ledger.record(model_key, dataset, system, payload["prompt_tokens"], payload["completion_tokens"],
+                      payload["cached_tokens"])
+        done.add(entry["key"])
+
+    # 缓存回放：只跑批处理覆盖到的作业 (含导出时被去重的重复题目)，未命中的请求直接报错而不是联网
+    run_s1 = partial(RUNS1.run_s1_task, k=RUNS1.S1_SAMPLES, mode="concurrent", cache=cache)
+    run_s2 = partial(RUNS2.run_s2_task, cache=cache, stream=False)
+    # S1 作业要求全部 S1_SAMPLES 个采样都有结果，缺采样的行不写入 (否则会以较少的采样数落盘并记为已完成)
+    jobs, incomplete = [], defaultdict(int)
+    for job in (build_jobs("s1", "📥 Ingest S1", run_s1, RUNS1.FIELDNAMES, all_models)
+                + build_jobs("s2", "📥 Ingest S2", run_s2, RUNS2.FIELDNAMES, all_models)):
+        keys = _job_keys(job)
+        got = sum(key in done for key in keys)
+        if got == len(keys):
+            jobs.append(job)
+        elif got:
+            incomplete[(job["model_key"], job["dataset"], job["system"])] += 1
+    for (model_key, dataset, system), n in sorted(incomplete.items()):
+        print(f"⚠️ {model_key} {dataset} {system}: {n} 个作业缺少部分采样结果，未写入，请重新导出提交")
+    if jobs:
+        offline = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=_offline_create)))
+        await run_jobs(jobs, all_models, offline, fsync=RUNS1.FSYNC)
+        print_cache_stats(cache)
+    ingest_judge(verdicts)
+
+    ledger.save()
+    print_ledger(ledger)
+    print("\n✨ 批处理结果导入完成！")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI Batch API 离线采集")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("export")
+    p.add_argument("--systems", nargs="+", default=["s1", "s2", "judge"], choices=["s1", "s2", "judge"])
+    p = sub.add_parser("submit")
+    p.add_argument("input")
+    p = sub.add_parser("download")
+    p.add_argument("batch_id")
+    p.add_argument("output")
+    p = sub.add_parser("fake")
+    p.add_argument("input")
+    p.add_argument("output")
+    p.add_argument("--p-error", type=float, default=0.0)
+    p.add_argument("--seed", type=int, default=None)
+    p = sub.add_parser("ingest")
+    p.add_argument("manifest")
+    p.add_argument("outputs", nargs="+")
+    args = parser.parse_args()
+
+    if args.cmd == "export":
+        export(args.systems)
+    elif args.cmd == "submit":
+        submit(args.input)
+    elif args.cmd == "download":
+        download(args.batch_id, args.output)
+    elif args.cmd == "fake":
+        count = fake_process(args.input, args.output, p_error=args.p_error, seed=args.seed)
+        print(f"🧪 假批处理完成: {count} 条 -> {args.output}")
+    elif args.cmd == "ingest":
+        asyncio.run(ingest(args.manifest, args.outputs))
+
+
+if __name__ == "__main__":
+    main()
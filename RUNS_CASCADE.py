@@ -0,0 +1,48 @@
+import asyncio
+from collections import Counter
+from functools import partial
+import RUNS1
+from Controller.controller import (run_cascade_task, run_speculative_task, print_routes,
+                                   CASCADE_THRESHOLDS, FIELDNAMES)
+from Collector.engine import sweep
+from Collector.limiter import AIMDRegistry, print_limits
+from Collector.providers import build_client
+from Collector.cache import ResponseCache, print_cache_stats
+from Collector.retry import Retrier, print_retry_stats
+from Collector.ledger import CostLedger
+
+# sequential: S1 后按需调用 S2 (省钱) | speculative: S1 与 S2 同时发出，S1 足够确定时取消 S2 (省延迟)
+CASCADE_MODE = "sequential"
+
+# --- 在线级联：每个任务先跑 S1，只有 should_call_s2 判定不够确定时才调用 S2 ---
+async def main_async():
+    api_key, all_models, base_url = RUNS1.load_config()
+    if not api_key: return
+
+    limiters = AIMDRegistry(all_models)
+    client = build_client(all_models, limiters, api_key, base_url)  # 每个 provider 一个连接池
+    await client.warmup()
+    cache = ResponseCache() if RUNS1.USE_CACHE else None
+    retrier = Retrier(hedge=RUNS1.HEDGE)
+    ledger = CostLedger(all_models, "cascade", budget_usd=RUNS1.BUDGET_USD, budget_tokens=RUNS1.BUDGET_TOKENS)
+    routes = Counter()
+
+    run_cascade = run_speculative_task if CASCADE_MODE == "speculative" else run_cascade_task
+    run_task = partial(run_cascade, thresholds=CASCADE_THRESHOLDS, cache=cache, retrier=retrier, routes=routes)
+    await sweep("cascade", "🔀 Running Cascade", run_task, FIELDNAMES, all_models, client,
+                fsync=RUNS1.FSYNC, ledger=ledger, budget_mode=RUNS1.BUDGET_MODE)
+    print_routes(routes)
+    print_limits(limiters)
+    print_retry_stats(retrier)
+    if cache:
+        print_cache_stats(cache)
+
+    print("\n✨ S1 → S2 级联采集完成！")
+
+
+def main():
+    asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    main()